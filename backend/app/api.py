@@ -1,24 +1,153 @@
-from fastapi import APIRouter, Request, Depends, HTTPException, Query
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Request, Depends, HTTPException, Query, BackgroundTasks
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import FileResponse, ORJSONResponse, Response, StreamingResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Dict, Any, List, Optional
+import io
+import hashlib
+import re
 import uuid
+import asyncio
+import threading
+import orjson
 import logging
 import time
 import os
 from datetime import datetime
-from pydantic import BaseModel, Field
-from app.infoextractor import InfoExtractorService
-from app.database import get_db
+from pydantic import BaseModel, ValidationError
+from app.infoextractor import InfoExtractorService, RefinementUnavailableError, ICS_DIR
+from app.database import get_db, get_async_db, SessionLocal
 from app.services.summarizer import summarizer_service
 from app.repositories.message_repository import message_repository
 from app.services.context import context_service
+from app.services.cache import cache, LocalCache
 from app.services.response_drafter import response_drafter_service
 
-router = APIRouter()
+router = APIRouter(default_response_class=ORJSONResponse)
 extractor = InfoExtractorService()
 logger = logging.getLogger(__name__)
 
+# Per-endpoint timings in response bodies are a debugging aid; the
+# X-Process-Time header covers every request regardless
+RETURN_PROCESSING_TIME = os.getenv("RETURN_PROCESSING_TIME", "false").lower() == "true"
+
+_ICS_FILENAME_RE = re.compile(r"[A-Za-z0-9_.-]+\.ics")
+# Entity tags in an If-None-Match list, capturing the quoted opaque tag
+_ETAG_RE = re.compile(r'(?:W/)?("[^"]*")')
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches etag, by weak comparison (RFC 9110 13.1.2)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    return opaque in _ETAG_RE.findall(if_none_match)
+
+# Contexts and summaries keyed by conversation version, so new messages or
+# re-chunking naturally miss instead of needing explicit invalidation
+_conversation_cache = LocalCache(maxsize=1024, ttl=120)
+
+def _conversation_cache_key(kind: str, db: Session, conversation_id: str, query: Optional[str]):
+    version = message_repository.get_conversation_version(db, conversation_id)
+    query_hash = hashlib.blake2b((query or "").encode("utf-8"), digest_size=8).digest()
+    return (kind, conversation_id, version, query_hash)
+
+def _get_context_cached(db: Session, conversation_id: str, query: Optional[str]) -> str:
+    key = _conversation_cache_key("context", db, conversation_id, query)
+    context = _conversation_cache.get(key)
+    if context is None:
+        # The key's version already holds the latest chunk id the context
+        # service would otherwise query for again
+        _, _, (_, latest_chunk_id), _ = key
+        context = context_service.get_context(db, conversation_id, query, latest_chunk_id=latest_chunk_id)
+        _conversation_cache.set(key, context)
+    return context
+
+async def _get_summary_cached(
+    db: Session,
+    conversation_id: str,
+    query: Optional[str],
+    force_refresh: bool
+) -> str:
+    key = await asyncio.to_thread(_conversation_cache_key, "summary", db, conversation_id, query)
+    summary = None if force_refresh else _conversation_cache.get(key)
+    if summary is None:
+        summary = await summarizer_service.aget_or_create_summary(
+            db, 
+            conversation_id,
+            query,
+            use_cache=True,
+            force_refresh=force_refresh
+        )
+        _conversation_cache.set(key, summary)
+    return summary
+
+def _with_processing_time(payload: Dict[str, Any], start_ns: int) -> Dict[str, Any]:
+    """Add processing_time (seconds) to a response body when enabled."""
+    if RETURN_PROCESSING_TIME:
+        payload["processing_time"] = (time.perf_counter_ns() - start_ns) / 1e9
+    return payload
+
+def _conversation_text(messages) -> str:
+    """Render messages as "author: content" blocks separated by blank lines."""
+    # Build the text without materializing a list of lines
+    buf = io.StringIO()
+    write = buf.write
+    separator = ""
+    for msg in messages:
+        write(separator)
+        write(msg.author)
+        write(": ")
+        write(msg.content)
+        separator = "\n\n"
+    return buf.getvalue()
+
+# Conversations with a re-chunk queued or running -> whether another pass was
+# requested since the current one started reading messages
+_chunk_jobs: Dict[str, bool] = {}
+_chunk_jobs_lock = threading.Lock()
+
+def _schedule_chunk_processing(background_tasks: BackgroundTasks, conversation_id: str):
+    """
+    Re-chunk a conversation after the response is sent, coalescing bursts.
+    
+    Only one task per conversation is queued or running at a time; writes that
+    land while it runs ask it for one more pass instead of racing it to
+    delete and rebuild the same chunks.
+    """
+    with _chunk_jobs_lock:
+        if conversation_id in _chunk_jobs:
+            _chunk_jobs[conversation_id] = True
+            return
+        _chunk_jobs[conversation_id] = False
+    background_tasks.add_task(_process_conversation_chunks_task, conversation_id)
+
+def _process_conversation_chunks_task(conversation_id: str):
+    """Re-chunk a conversation outside the request cycle with its own session."""
+    while True:
+        with _chunk_jobs_lock:
+            # Messages written before this point are picked up by this pass
+            _chunk_jobs[conversation_id] = False
+        # Nothing may escape here, or the conversation would stay registered
+        # and never be re-chunked again
+        try:
+            db = SessionLocal()
+            try:
+                message_repository.process_conversation_chunks(db, conversation_id)
+                # Drop any context cached against the old chunks
+                cache.invalidate_conversation(conversation_id)
+                context_service.invalidate_local(conversation_id)
+            finally:
+                db.close()
+        except Exception as e:
+            logger.exception(f"Error processing chunks for conversation {conversation_id}: {e}")
+        with _chunk_jobs_lock:
+            if not _chunk_jobs[conversation_id]:
+                del _chunk_jobs[conversation_id]
+                return
+
 class TextRequest(BaseModel):
     text: str
     as_user: Optional[str] = None
@@ -36,11 +165,17 @@ class MessagesUploadRequest(BaseModel):
 class ContextResponse(BaseModel):
     context: str
     context_size: int
-    processing_time: float
+    processing_time: Optional[float] = None
 
 class SummaryResponse(BaseModel):
     summary: str
-    processing_time: float
+    processing_time: Optional[float] = None
+
+class KeyInfoBatchRequest(BaseModel):
+    conversation_ids: List[str]
+
+class SummaryBatchRequest(BaseModel):
+    conversation_ids: List[str]
 
 class DraftResponseRequest(BaseModel):
     text: str
@@ -51,55 +186,107 @@ class DraftResponseRequest(BaseModel):
 @router.post("/summarize")
 async def summarize(request: Request):
     """Legacy endpoint for summarizing text directly."""
-    data = await request.json()
+    data = orjson.loads(await request.body())
     text = data.get("text", "")
 
     if not text:
         return {"error": "No text provided."}
 
-    start_time = time.time()
-    summary = summarizer_service.summarize_conversation(text)
-    processing_time = time.time() - start_time
+    start_ns = time.perf_counter_ns()
+    summary = await summarizer_service.summarize_conversation(text)
     
+    return _with_processing_time({"summary": summary}, start_ns)
+
+def _sse_stream(deltas) -> StreamingResponse:
+    """Send text deltas as Server-Sent Events, ending with a done or error event."""
+    async def events():
+        try:
+            async for delta in deltas:
+                yield b"data: " + orjson.dumps({"delta": delta}) + b"\n\n"
+        except RuntimeError as e:
+            # Headers are already sent, so report failures in-band
+            yield b"event: error\ndata: " + orjson.dumps({"detail": str(e)}) + b"\n\n"
+            return
+        yield b"event: done\ndata: {}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/summarize/stream")
+async def stream_summarize(request: Request):
+    """Stream a summary of text as Server-Sent Events while it is generated."""
+    data = orjson.loads(await request.body())
+    text = data.get("text", "")
+
+    if not text:
+        return {"error": "No text provided."}
+
+    return _sse_stream(summarizer_service.stream_summarize_conversation(text))
+
+def _json_body_schema(model) -> Dict[str, Any]:
+    """OpenAPI request body for endpoints that validate the raw body themselves."""
+    schema = model.model_json_schema(ref_template="#/components/schemas/{model}")
+    schema.pop("$defs", None)
     return {
-        "summary": summary,
-        "processing_time": processing_time
+        "requestBody": {
+            "content": {"application/json": {"schema": schema}},
+            "required": True
+        }
     }
 
-@router.post("/conversations", status_code=201)
+@router.post(
+    "/conversations",
+    status_code=201,
+    openapi_extra=_json_body_schema(MessagesUploadRequest)
+)
 async def create_conversation(
-    request: MessagesUploadRequest,
+    raw_request: Request,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     """Create a new conversation from messages."""
+    # Validate straight from the raw JSON bytes, skipping the json.loads +
+    # dict validation round trip of a regular body parameter
+    try:
+        request = MessagesUploadRequest.model_validate_json(await raw_request.body())
+    except ValidationError as e:
+        raise RequestValidationError([
+            {**error, "loc": ("body", *error["loc"])} for error in e.errors()
+        ])
+
     # Generate conversation ID if not provided
     conversation_id = request.conversation_id or str(uuid.uuid4())
     
     # Convert Pydantic models to dictionaries
-    messages_data = []
-    for msg in request.messages:
-        messages_data.append(msg.dict(exclude_none=True))
+    messages_data = [msg.model_dump(exclude_none=True) for msg in request.messages]
     
     # Create messages
-    start_time = time.time()
-    messages = message_repository.create_messages(db, conversation_id, messages_data)
-    processing_time = time.time() - start_time
+    start_ns = time.perf_counter_ns()
+    messages = await asyncio.to_thread(
+        message_repository.create_messages, db, conversation_id, messages_data
+    )
     
-    return {
+    # Chunking and embedding happen after the response is sent
+    _schedule_chunk_processing(background_tasks, conversation_id)
+    
+    return _with_processing_time({
         "conversation_id": conversation_id,
-        "message_count": len(messages),
-        "processing_time": processing_time
-    }
+        "message_count": len(messages)
+    }, start_ns)
 
 @router.post("/conversations/{conversation_id}/messages", status_code=201)
 async def add_message(
     conversation_id: str,
     request: MessageRequest,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     """Add a message to an existing conversation."""
     # Create message
-    start_time = time.time()
+    start_ns = time.perf_counter_ns()
     message = message_repository.create_message(
         db,
         conversation_id,
@@ -108,54 +295,60 @@ async def add_message(
         request.timestamp,
         request.metadata
     )
-    processing_time = time.time() - start_time
     
-    # Process chunks (async in a real implementation)
-    message_repository._process_conversation_chunks(db, conversation_id)
+    # Process chunks after the response is sent; the request session is
+    # closed by then, so the task opens its own
+    _schedule_chunk_processing(background_tasks, conversation_id)
     
-    return {
+    return _with_processing_time({
         "message_id": message.id,
-        "conversation_id": conversation_id,
-        "processing_time": processing_time
-    }
+        "conversation_id": conversation_id
+    }, start_ns)
 
 @router.get("/conversations/{conversation_id}/messages")
 async def get_messages(
     conversation_id: str,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get messages from a conversation."""
-    start_time = time.time()
-    messages = message_repository.get_messages(db, conversation_id, skip, limit)
-    processing_time = time.time() - start_time
+    start_ns = time.perf_counter_ns()
+    messages = await message_repository.get_message_dicts_async(db, conversation_id, skip, limit)
+    # Return the connection to the pool before serializing the response
+    await db.close()
     
-    return {
+    # orjson serializes the datetime timestamps natively
+    return ORJSONResponse(content=_with_processing_time({
         "conversation_id": conversation_id,
-        "messages": [message.to_dict() for message in messages],
-        "count": len(messages),
-        "processing_time": processing_time
-    }
+        "messages": messages,
+        "count": len(messages)
+    }, start_ns))
 
-@router.get("/conversations/{conversation_id}/context", response_model=ContextResponse)
+@router.get(
+    "/conversations/{conversation_id}/context",
+    response_model=ContextResponse,
+    response_model_exclude_none=True
+)
 async def get_conversation_context(
     conversation_id: str,
     query: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """Get context for a conversation, optionally filtered by query."""
-    start_time = time.time()
-    context = context_service.get_context(db, conversation_id, query)
-    processing_time = time.time() - start_time
+    start_ns = time.perf_counter_ns()
+    context = await asyncio.to_thread(_get_context_cached, db, conversation_id, query)
     
-    return {
+    return _with_processing_time({
         "context": context,
-        "context_size": len(context),
-        "processing_time": processing_time
-    }
+        "context_size": len(context)
+    }, start_ns)
 
-@router.get("/conversations/{conversation_id}/summary", response_model=SummaryResponse)
+@router.get(
+    "/conversations/{conversation_id}/summary",
+    response_model=SummaryResponse,
+    response_model_exclude_none=True
+)
 async def get_conversation_summary(
     conversation_id: str,
     query: Optional[str] = None,
@@ -163,20 +356,38 @@ async def get_conversation_summary(
     db: Session = Depends(get_db)
 ):
     """Get a summary for a conversation, optionally focused on a query."""
-    start_time = time.time()
-    summary = summarizer_service.get_or_create_summary(
-        db, 
-        conversation_id,
-        query,
-        use_cache=True,
-        force_refresh=force_refresh
-    )
-    processing_time = time.time() - start_time
+    start_ns = time.perf_counter_ns()
+    summary = await _get_summary_cached(db, conversation_id, query, force_refresh)
     
-    return {
-        "summary": summary,
-        "processing_time": processing_time
-    }
+    return _with_processing_time({"summary": summary}, start_ns)
+
+@router.post("/conversations/summary/batch", status_code=202)
+async def submit_summary_batch(
+    request: SummaryBatchRequest,
+    db: Session = Depends(get_db)
+):
+    """Queue full summaries for many conversations on the OpenAI Batch API."""
+    try:
+        batch_id, skipped = await summarizer_service.submit_batch(db, request.conversation_ids)
+    except Exception as e:
+        logger.error(f"Error submitting summary batch: {e}")
+        raise HTTPException(500, f"Failed to submit summary batch: {str(e)}")
+
+    submitted = [cid for cid in dict.fromkeys(request.conversation_ids) if cid not in skipped] if batch_id else []
+    return {"batch_id": batch_id, "submitted": submitted, "skipped": skipped}
+
+@router.get("/conversations/summary/batch/{batch_id}")
+async def get_summary_batch(batch_id: str, db: Session = Depends(get_db)):
+    """Poll a summary batch, storing its summaries once complete."""
+    try:
+        status, summaries = await summarizer_service.poll_batch(db, batch_id)
+    except Exception as e:
+        logger.error(f"Error fetching summary batch: {e}")
+        raise HTTPException(500, f"Failed to fetch summary batch: {str(e)}")
+
+    if summaries is None:
+        return {"batch_id": batch_id, "status": status}
+    return {"batch_id": batch_id, "status": status, "results": summaries}
 
 @router.post("/draft_response")
 async def draft_response(request: DraftResponseRequest):
@@ -184,31 +395,73 @@ async def draft_response(request: DraftResponseRequest):
     if not request.text:
         return {"error": "No text provided."}
 
-    start_time = time.time()
-    draft = response_drafter_service.draft_response(
+    start_ns = time.perf_counter_ns()
+    draft = await response_drafter_service.draft_response(
         request.text, 
         request.as_user,
         request.user_input,
         request.prefer_something
     )
-    processing_time = time.time() - start_time
     
-    return {
-        "draft": draft,
-        "processing_time": processing_time
-    }
+    return _with_processing_time({"draft": draft}, start_ns)
+
+@router.post("/draft_response/stream")
+async def stream_draft_response(request: DraftResponseRequest):
+    """Stream a drafted response as Server-Sent Events while it is generated."""
+    if not request.text:
+        return {"error": "No text provided."}
+
+    return _sse_stream(response_drafter_service.stream_draft_response(
+        request.text,
+        request.as_user,
+        request.user_input,
+        request.prefer_something
+    ))
 
 @router.get("/ics/{filename}")
-async def get_ics_file(filename: str):
+async def get_ics_file(filename: str, request: Request):
     """Serve ICS calendar files."""
-    file_path = os.path.join(os.getcwd(), "ics_files", filename)
-    if not os.path.exists(file_path):
+    # Only plain generated names, never paths
+    if not _ICS_FILENAME_RE.fullmatch(filename):
         raise HTTPException(status_code=404, detail="ICS file not found")
+
+    # ICS files never change once generated, so let clients revalidate by ETag
+    headers = {
+        "Content-Disposition": f"attachment; filename={filename}",
+        "Cache-Control": "public, max-age=86400"
+    }
+
+    # Recently generated files are served from memory
+    cached = extractor.get_cached_ics(filename)
+    if cached:
+        content, etag = cached
+        file_path = None
+    else:
+        file_path = os.path.join(ICS_DIR, filename)
+        try:
+            os.stat(file_path)
+        except OSError:
+            raise HTTPException(status_code=404, detail="ICS file not found")
+        try:
+            with open(f"{file_path}.etag") as f:
+                etag = f.read().strip()
+        except OSError:
+            etag = None
+
+    if etag:
+        # Weak, since the same tag covers the gzip and identity encodings
+        etag = f'W/"{etag}"'
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": headers["Cache-Control"]})
+        headers["ETag"] = etag
+
+    if file_path is None:
+        return Response(content=content, media_type="text/calendar", headers=headers)
     return FileResponse(
         file_path,
         media_type="text/calendar",
         filename=filename,
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+        headers=headers
     )
 
 @router.post("/conversations/{conversation_id}/keyinfo")
@@ -218,32 +471,87 @@ async def get_key_info(
 ):
     try:
         # Get messages directly from the database if context service fails
-        messages = message_repository.get_messages(db, conversation_id)
+        messages = await asyncio.to_thread(message_repository.get_messages, db, conversation_id)
         if not messages:
             raise HTTPException(404, "Conversation not found")
             
-        # Convert messages to text format
-        conversation_text = "\n\n".join([
-            f"{msg.author}: {msg.content}"
-            for msg in messages
-        ])
+        conversation_text = _conversation_text(messages)
         
         # Extract key info
-        raw = extractor.extract_key_info(conversation_text)
+        raw = await asyncio.to_thread(extractor.extract_key_info, conversation_text)
         if not raw:
             return {"key_info": "No events or important dates found in the conversation.", "ics_file": ""}
             
         # Refine with GPT
-        refined = extractor.refine_key_info_with_gpt(conversation_text, raw)
+        refined = await extractor.refine_key_info_with_gpt(conversation_text, raw)
         if not refined or refined.strip() == "":
             return {"key_info": "No events or important dates found in the conversation.", "ics_file": ""}
         
         # Generate ICS file
-        ics_filename = extractor.generate_ics(refined)
+        ics_filename = await asyncio.to_thread(extractor.generate_ics, refined)
         if not ics_filename:
             return {"key_info": refined, "ics_file": ""}
 
         return {"key_info": refined, "ics_file": f"/ics/{ics_filename}"}
+    except HTTPException:
+        raise
+    except RefinementUnavailableError as e:
+        # Rate limited or unreachable even after retries; tell the client to
+        # come back rather than reporting a server fault
+        logger.warning(f"Key info temporarily unavailable: {e}")
+        raise HTTPException(503, str(e), headers={"Retry-After": "30"})
     except Exception as e:
         logger.error(f"Error getting key info: {e}")
-        raise HTTPException(500, f"Failed to get key info: {str(e)}")
\ No newline at end of file
+        raise HTTPException(500, f"Failed to get key info: {str(e)}")
+
+@router.post("/conversations/keyinfo/batch", status_code=202)
+async def submit_key_info_batch(
+    request: KeyInfoBatchRequest,
+    db: Session = Depends(get_db)
+):
+    """Queue key info refinement for many conversations on the OpenAI Batch API."""
+    jobs = []
+    skipped = []
+    for conversation_id in dict.fromkeys(request.conversation_ids):
+        messages = await asyncio.to_thread(message_repository.get_messages, db, conversation_id)
+        if not messages:
+            skipped.append(conversation_id)
+            continue
+        conversation_text = _conversation_text(messages)
+        raw = await asyncio.to_thread(extractor.extract_key_info, conversation_text)
+        if not raw:
+            skipped.append(conversation_id)
+            continue
+        jobs.append({"custom_id": conversation_id, "conversation_text": conversation_text, "key_info": raw})
+
+    if not jobs:
+        return {"batch_id": None, "submitted": [], "skipped": skipped}
+
+    try:
+        batch_id = await extractor.submit_batch(jobs)
+    except Exception as e:
+        logger.error(f"Error submitting key info batch: {e}")
+        raise HTTPException(500, f"Failed to submit key info batch: {str(e)}")
+
+    return {"batch_id": batch_id, "submitted": [job["custom_id"] for job in jobs], "skipped": skipped}
+
+@router.get("/conversations/keyinfo/batch/{batch_id}")
+async def get_key_info_batch(batch_id: str):
+    """Poll a key info batch and build ICS files for its results once complete."""
+    try:
+        status, results = await extractor.poll_and_fetch(batch_id)
+    except Exception as e:
+        logger.error(f"Error fetching key info batch: {e}")
+        raise HTTPException(500, f"Failed to fetch key info batch: {str(e)}")
+
+    if results is None:
+        return {"batch_id": batch_id, "status": status}
+
+    conversations = {}
+    for conversation_id, refined in results.items():
+        ics_filename = await asyncio.to_thread(extractor.generate_ics, refined) if refined else ""
+        conversations[conversation_id] = {
+            "key_info": refined or "No events or important dates found in the conversation.",
+            "ics_file": f"/ics/{ics_filename}" if ics_filename else ""
+        }
+    return {"batch_id": batch_id, "status": status, "results": conversations}
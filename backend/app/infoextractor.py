@@ -1,194 +1,528 @@
 # app/infoextractor.py
 import os
 import re
-import time
+import asyncio
 import logging
-from datetime import datetime, timedelta
+import hashlib
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from datetime import date, datetime, timedelta
 from dotenv import load_dotenv
-from openai import OpenAIError, OpenAI
-from dateparser import parse as parse_date
+from openai import OpenAIError, APIConnectionError, APITimeoutError, RateLimitError
+from dateparser.date import DateDataParser
+from app.services.cache import cache, LocalCache
+from app.services.openai_client import openai_client
+from app.services.openai_batch import BATCH_TRACKING_TTL, submit_chat_batch, fetch_chat_batch
+from app.services.tokenizer import tokenizer
 
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
-openai_api_key = os.getenv("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=openai_api_key)
+
+# Still failing after the SDK's retries, but worth trying again later
+_TRANSIENT_OPENAI_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError)
+
+class RefinementUnavailableError(RuntimeError):
+    """Raised when OpenAI is rate limiting or unreachable after retries."""
+
+# Caps in-flight completions per process so concurrent refinements queue
+# here instead of tripping the account's rate limit
+_openai_semaphore = asyncio.Semaphore(int(os.getenv("OPENAI_CONCURRENCY", "8")))
 
 # Create a directory for ICS files if it doesn't exist
 ICS_DIR = os.path.join(os.getcwd(), "ics_files")
 os.makedirs(ICS_DIR, exist_ok=True)
 
+# More comprehensive event keywords
+_ACADEMIC_EVENTS = ("Lecture", "class", "exam", "test", "quiz", "assignment", "project", "presentation", "demo", "review", "discussion", "tutorial", "lab", "office hours")
+_PROFESSIONAL_EVENTS = ("meeting", "consultation", "check-in", "catch-up", "sync", "standup", "planning", "retrospective", "review", "debrief", "briefing", "orientation", "training", "onboarding")
+_SOCIAL_EVENTS = ("workshop", "hackathon", "meetup", "gathering", "party", "celebration", "ceremony", "graduation", "commencement", "convocation", "induction", "inauguration", "launch", "opening", "closing", "finale", "showcase", "exhibition", "fair", "festival")
+_GENERAL_EVENTS = ("Reminder", "starts", "TODAY", "TIME CHANGE", "event", "appointment", "deadline", "due", "schedule", "session", "call", "interview")
+
+# Lowercased keywords, deduplicated across groups
+_EVENT_KEYWORDS_LOWER = tuple(dict.fromkeys(
+    keyword.lower()
+    for group in (_ACADEMIC_EVENTS, _PROFESSIONAL_EVENTS, _SOCIAL_EVENTS, _GENERAL_EVENTS)
+    for keyword in group
+))
+
+# One flat alternation instead of a group per category, longest keywords
+# first so a short keyword never shadows a longer one starting at the same
+# position. The main pattern runs on lowercased text without IGNORECASE,
+# which is several times faster; the flagged copy covers texts whose length
+# changes when lowercased
+_EVENT_KEYWORDS_PATTERN = r"\b(?:" + "|".join(
+    re.escape(keyword) for keyword in sorted(_EVENT_KEYWORDS_LOWER, key=len, reverse=True)
+) + r")\b"
+_EVENT_KEYWORDS_LOWER_RE = re.compile(_EVENT_KEYWORDS_PATTERN)
+_EVENT_KEYWORDS_RE = re.compile(_EVENT_KEYWORDS_PATTERN, re.IGNORECASE)
+
+# Lowercase long texts a window at a time for the keyword pre-check rather
+# than copying the whole conversation; windows overlap by one keyword length
+_KEYWORD_SCAN_WINDOW = 1 << 16
+_KEYWORD_SCAN_OVERLAP = max(len(keyword) for keyword in _EVENT_KEYWORDS_LOWER) - 1
+
+def _contains_event_keyword(text: str) -> bool:
+    for start in range(0, len(text), _KEYWORD_SCAN_WINDOW):
+        window = text[start:start + _KEYWORD_SCAN_WINDOW + _KEYWORD_SCAN_OVERLAP].lower()
+        if any(keyword in window for keyword in _EVENT_KEYWORDS_LOWER):
+            return True
+    return False
+
+# Every date/time pattern below needs a digit or a relative date word, so
+# blocks without one can never produce an event
+_HAS_DATEISH_RE = re.compile(r"[0-9]|tomorrow|today|next\s+(?:week|month)", re.IGNORECASE)
+
+# More flexible date patterns
+_DATE_RES = (
+    re.compile(r"\b(\d{4}[-/]\d{1,2}[-/]\d{1,2})\b"),  # YYYY-MM-DD or YYYY/MM/DD
+    re.compile(r"\b(\d{1,2}[-/]\d{1,2}[-/]\d{4})\b"),  # DD-MM-YYYY or DD/MM/YYYY
+    re.compile(r"\b(Jan(?:uary)?|Feb(?:ruary)?|Mar(?:ch)?|Apr(?:il)?|May|Jun(?:e)?|Jul(?:y)?|Aug(?:ust)?|Sep(?:tember)?|Oct(?:ober)?|Nov(?:ember)?|Dec(?:ember)?)\s+\d{1,2}(?:st|nd|rd|th)?,?\s+\d{4}\b", re.IGNORECASE),  # Month DD, YYYY
+    re.compile(r"\b\d{1,2}(?:st|nd|rd|th)?\s+(Jan(?:uary)?|Feb(?:ruary)?|Mar(?:ch)?|Apr(?:il)?|May|Jun(?:e)?|Jul(?:y)?|Aug(?:ust)?|Sep(?:tember)?|Oct(?:ober)?|Nov(?:ember)?|Dec(?:ember)?),?\s+\d{4}\b", re.IGNORECASE),  # DD Month YYYY
+    re.compile(r"\b(tomorrow|today|next week|next month)\b", re.IGNORECASE)  # Relative dates
+)
+
+# More flexible time patterns
+_TIME_RES = (
+    re.compile(r"\b(\d{1,2}(?::\d{2})?\s*(?:AM|PM|am|pm|A\.M\.|P\.M\.|a\.m\.|p\.m\.))\b", re.IGNORECASE),  # 12-hour format
+    re.compile(r"\b(\d{1,2}:\d{2})\b"),  # 24-hour format
+    re.compile(r"\b(\d{1,2}(?::\d{2})?\s*(?:o'clock|oclock|o' clock|o clock))\b", re.IGNORECASE),  # o'clock format
+    re.compile(r"\b(\d{1,2}(?::\d{2})?)\b")  # Just numbers
+)
+
+# Markdown emphasis/links and URLs stripped from candidate lines in one pass.
+# Link text and targets are bounded by their closing bracket, so a stray "["
+# can neither swallow the text up to a later link nor backtrack across the line
+_CLEAN_RE = re.compile(r"\*\*|\[[^\]]*\]\([^)]*\)|http\S+")
+
+# Event line format produced by refine_key_info_with_gpt
+_ICS_EVENT_LINE_RE = re.compile(
+    r"^-\s*(.+?)\s*—\s*(\d{4}-\d{2}-\d{2})\s+at\s+(\d{1,2}:\d{2})(AM|PM)$"
+)
+
+_ICS_EVENT_TIME_FORMAT = "%Y-%m-%d %I:%M%p"
+
+# Fixed date/time shapes the patterns above produce, tried before dateparser
+_FAST_DATE_FORMATS = (
+    "%Y-%m-%d",
+    "%Y/%m/%d",
+    "%m/%d/%Y",
+    "%m-%d-%Y",
+    "%B %d, %Y",
+    "%B %d %Y",
+    "%b %d, %Y",
+    "%b %d %Y",
+)
+
+@lru_cache(maxsize=4096)
+def _parse_fixed_format(value: str) -> Optional[datetime]:
+    """Parse an absolute date string with strptime, or None if no format fits."""
+    # Zero-padded YYYY-MM-DD / YYYY/MM/DD go through the C ISO parser
+    if len(value) == 10 and value[4] == value[7] and value[4] in "-/":
+        try:
+            return datetime.fromisoformat(value.replace("/", "-"))
+        except ValueError:
+            pass
+    for fmt in _FAST_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+# dateparser fallbacks configured once; a fixed language list skips the
+# per-call language detection done by dateparser.parse
+_DATE_PARSER = DateDataParser(languages=["en"])
+_FUTURE_DATE_PARSER = DateDataParser(languages=["en"], settings={"PREFER_DATES_FROM": "future"})
+
+def _fast_parse(value: str, prefer_future: bool = False) -> Optional[datetime]:
+    """
+    Parse a date string, only falling back to dateparser for ambiguous or
+    relative input. Relative results depend on the current time, so only the
+    strptime path is cached.
+    """
+    dt = _parse_fixed_format(value)
+    if dt is None:
+        parser = _FUTURE_DATE_PARSER if prefer_future else _DATE_PARSER
+        dt = parser.get_date_data(value).date_obj
+    return dt
+
+@lru_cache(maxsize=4096)
+def _parse_event_date(value: str, today: date) -> Optional[str]:
+    """
+    Resolve a matched date string to YYYY-MM-DD, preferring future dates.
+    Keyed on today's date so relative or year-less input ("tomorrow", "Feb")
+    resolves again once the day changes; both arguments must be hashable.
+    """
+    try:
+        dt = _fast_parse(value, prefer_future=True)
+    except Exception:
+        return None
+    if not dt:
+        return None
+    # Same integer formatting as _format_ics_stamp; %Y is unpadded on glibc
+    return "%d-%02d-%02d" % (dt.year, dt.month, dt.day)
+
+_REFINE_INSTRUCTIONS = (
+    "You are an expert at validating and formatting notification‐style events.\n"
+    "Below are candidate events. Please format them as follows:\n"
+    "1. Each event should be on a new line starting with a dash\n"
+    "2. Format: \"- Event Description — YYYY-MM-DD at HH:MMAM/PM\"\n"
+    "3. Times must be in 12-hour format with AM/PM\n"
+    "4. Skip events with TBD dates or times\n"
+    "5. Remove any leftover URLs or markdown\n"
+    "6. Deduplicate if there are repeats\n"
+    "Example format:\n"
+    "- Lecture 2 w/ Jason Weston — 2025-02-03 at 4:00PM\n"
+    "- Team Meeting — 2025-02-04 at 10:30AM\n"
+)
+
+# Conversation context sent with each refinement, in model tokens
+_CONVERSATION_TOKEN_LIMIT = 1500
+
+@lru_cache(maxsize=256)
+def _conversation_context(conversation_text: str) -> str:
+    """
+    Cut a conversation to the refinement token budget. Cached, since the
+    fingerprint and the request for the same conversation both need it.
+    """
+    return tokenizer.truncate_to_token_count(conversation_text, _CONVERSATION_TOKEN_LIMIT)
+
+_ICS_HEADER = (
+    "BEGIN:VCALENDAR\n"
+    "VERSION:2.0\n"
+    "PRODID:-//SociaMate//Calendar Events//EN\n"
+    "CALSCALE:GREGORIAN\n"
+    "METHOD:PUBLISH\n"
+)
+
+_ICS_EVENT_TEMPLATE = (
+    "BEGIN:VEVENT\n"
+    "DTSTAMP:{stamp}\n"
+    "DTSTART:{start}\n"
+    "DTEND:{end}\n"
+    "SUMMARY:{summary}\n"
+    "SEQUENCE:0\n"
+    "STATUS:CONFIRMED\n"
+    "TRANSP:OPAQUE\n"
+    "END:VEVENT\n"
+)
+
+def _write_atomic(path: str, data: bytes) -> None:
+    """Write a file under a temporary name and rename it over the target."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    # The content is already fully rendered bytes, so hand it straight to
+    # the file descriptor instead of copying it through a buffered writer
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+    os.replace(tmp_path, path)
+
+def _render_ics(events: List[Tuple[str, datetime]]) -> bytes:
+    """Render parsed events into a calendar; no parsing or error handling needed."""
+    created_stamp = _format_ics_stamp(datetime.utcnow())
+    local_tz = datetime.now().astimezone().tzinfo
+    parts = [_ICS_HEADER]
+    for desc, dt in events:
+        # Convert to UTC
+        dt = dt.astimezone(local_tz)
+        # Add 1 hour for the event duration
+        end_dt = dt + timedelta(hours=1)
+        parts.append(_ICS_EVENT_TEMPLATE.format(
+            stamp=created_stamp,
+            start=_format_ics_stamp(dt),
+            end=_format_ics_stamp(end_dt),
+            summary=desc
+        ))
+        logger.info(f"Successfully added event: {desc} at {dt}")
+    parts.append("END:VCALENDAR")
+    return "".join(parts).encode("utf-8")
+
+def _format_ics_stamp(dt: datetime) -> str:
+    """Format a datetime as an ICS timestamp without going through strftime."""
+    return "%04d%02d%02dT%02d%02d%02dZ" % (dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second)
+
 class InfoExtractorService:
     """Service for extracting key notification information from conversations."""
 
-    def __init__(self, cache_ttl: int = 3600):
+    def __init__(self, cache_ttl: int = 3600, local_cache_size: int = 512):
         self.cache_ttl = cache_ttl
+        self._refined_cache = LocalCache(maxsize=local_cache_size, ttl=cache_ttl)
+        # ICS filename -> (content, etag); files never change once generated
+        self._ics_cache = LocalCache(maxsize=local_cache_size, ttl=None)
+        # Extraction is pure given the text and the current day, and the same
+        # conversation is often re-extracted (reopening the calendar dialog)
+        self._extracted_cache = LocalCache(maxsize=local_cache_size, ttl=cache_ttl)
+
+    def clear_cache(self) -> None:
+        """Drop all in-process extraction, refinement and ICS results."""
+        self._extracted_cache.clear()
+        self._refined_cache.clear()
+        self._ics_cache.clear()
+
+    def get_cached_ics(self, filename: str) -> Optional[Tuple[bytes, str]]:
+        """Get the content and ETag of a recently generated ICS file, if still cached."""
+        return self._ics_cache.get(filename)
+
+    def _refinement_fingerprint(self, conversation_text: str, key_info: str) -> str:
+        """Whitespace-insensitive hash of the exact input sent to the model."""
+        normalized = " ".join(_conversation_context(conversation_text).split()) + "\x00" + " ".join(key_info.split())
+        return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).hexdigest()
+
+    async def _get_cached_refinement(self, fingerprint: str) -> Optional[str]:
+        refined = self._refined_cache.get(fingerprint)
+        if refined:
+            return refined
+
+        # Fall back to Redis so results survive restarts; in a worker thread,
+        # since a slow Redis would otherwise stall every request on the loop
+        refined = await asyncio.to_thread(cache.get, f"keyinfo:refined:{fingerprint}")
+        if refined:
+            self._refined_cache.set(fingerprint, refined)
+        return refined
 
     def extract_key_info(self, text: str) -> str:
+        # Relative dates resolve against today, so the day is part of the key
+        key = (hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest(), date.today())
+        key_info = self._extracted_cache.get(key)
+        if key_info is None:
+            key_info = self._extract_key_info(text, key[1])
+            self._extracted_cache.set(key, key_info)
+        return key_info
+
+    def _extract_key_info(self, text: str, today: date) -> str:
+        # Most chit-chat has no event keyword at all; find that out with plain
+        # substring scans instead of the case-insensitive keyword regex
+        if not _contains_event_keyword(text):
+            return ""
+
+        # Match keywords against a lowercased copy; positions carry over to the
+        # original as long as lowercasing kept every character one character
+        lowered = text.lower()
+        if len(lowered) == len(text):
+            keyword_re, haystack = _EVENT_KEYWORDS_LOWER_RE, lowered
+        else:
+            keyword_re, haystack = _EVENT_KEYWORDS_RE, text
+
         events = []
-        # More comprehensive event keywords
-        academic_events = r"\b(Lecture|class|exam|test|quiz|assignment|project|presentation|demo|review|discussion|tutorial|lab|office hours)\b"
-        professional_events = r"\b(meeting|consultation|check-in|catch-up|sync|standup|planning|retrospective|review|debrief|briefing|orientation|training|onboarding)\b"
-        social_events = r"\b(workshop|hackathon|meetup|gathering|party|celebration|ceremony|graduation|commencement|convocation|induction|inauguration|launch|opening|closing|finale|showcase|exhibition|fair|festival)\b"
-        general_events = r"\b(Reminder|starts|TODAY|TIME CHANGE|event|appointment|deadline|due|schedule|session|call|interview)\b"
-        event_keywords = f"({academic_events}|{professional_events}|{social_events}|{general_events})"
-        
-        # More flexible date patterns
-        date_patterns = [
-            r"\b(\d{4}[-/]\d{1,2}[-/]\d{1,2})\b",  # YYYY-MM-DD or YYYY/MM/DD
-            r"\b(\d{1,2}[-/]\d{1,2}[-/]\d{4})\b",  # DD-MM-YYYY or DD/MM/YYYY
-            r"\b(Jan(?:uary)?|Feb(?:ruary)?|Mar(?:ch)?|Apr(?:il)?|May|Jun(?:e)?|Jul(?:y)?|Aug(?:ust)?|Sep(?:tember)?|Oct(?:ober)?|Nov(?:ember)?|Dec(?:ember)?)\s+\d{1,2}(?:st|nd|rd|th)?,?\s+\d{4}\b",  # Month DD, YYYY
-            r"\b\d{1,2}(?:st|nd|rd|th)?\s+(Jan(?:uary)?|Feb(?:ruary)?|Mar(?:ch)?|Apr(?:il)?|May|Jun(?:e)?|Jul(?:y)?|Aug(?:ust)?|Sep(?:tember)?|Oct(?:ober)?|Nov(?:ember)?|Dec(?:ember)?),?\s+\d{4}\b",  # DD Month YYYY
-            r"\b(tomorrow|today|next week|next month)\b"  # Relative dates
-        ]
-        
-        # More flexible time patterns
-        time_patterns = [
-            r"\b(\d{1,2}(?::\d{2})?\s*(?:AM|PM|am|pm|A\.M\.|P\.M\.|a\.m\.|p\.m\.))\b",  # 12-hour format
-            r"\b(\d{1,2}:\d{2})\b",  # 24-hour format
-            r"\b(\d{1,2}(?::\d{2})?\s*(?:o'clock|oclock|o' clock|o clock))\b",  # o'clock format
-            r"\b(\d{1,2}(?::\d{2})?)\b"  # Just numbers
-        ]
-
-        for block in text.split("\n\n"):
-            line = block.strip()
-            if not line:
-                continue
-                
-            # Check for event keywords
-            if not re.search(event_keywords, line, re.IGNORECASE):
+        pos = 0
+        length = len(text)
+
+        # Scan the whole text once for event keywords and only slice out the
+        # blank-line-separated blocks that contain one
+        while pos < length:
+            m_keyword = keyword_re.search(haystack, pos)
+            if not m_keyword:
+                break
+
+            start = text.rfind("\n\n", 0, m_keyword.start())
+            start = 0 if start == -1 else start + 2
+            end = text.find("\n\n", m_keyword.end())
+            if end == -1:
+                end = length
+            pos = end
+
+            if not _HAS_DATEISH_RE.search(text, start, end):
                 continue
+
+            line = text[start:end].strip()
                 
-            # Clean the text but preserve more information
-            clean = re.sub(r"\*\*|\[.*?\]\(.*?\)", "", line)
-            clean = re.sub(r"http\S+", "", clean).strip()
+            # Clean the text but preserve more information; most lines have no
+            # markdown or links, so skip the substitutions when they can't match
+            if "**" in line or "[" in line or "http" in line:
+                clean = _CLEAN_RE.sub("", line).strip()
+            else:
+                clean = line.strip()
             
             # Try to find a date
-            dt = None
-            for pattern in date_patterns:
-                m_date = re.search(pattern, clean, re.IGNORECASE)
+            date_str = None
+            for pattern in _DATE_RES:
+                m_date = pattern.search(clean)
                 if m_date:
-                    try:
-                        dt = parse_date(m_date.group(1), settings={"PREFER_DATES_FROM": "future"})
-                        if dt:
-                            break
-                    except:
-                        continue
+                    date_str = _parse_event_date(m_date.group(1), today)
+                    if date_str:
+                        break
             
             # Try to find a time
             time_str = None
-            for pattern in time_patterns:
-                m_time = re.search(pattern, clean, re.IGNORECASE)
+            for pattern in _TIME_RES:
+                m_time = pattern.search(clean)
                 if m_time:
                     time_str = m_time.group(1).upper().replace(" ", "")
                     break
             
             # If we found either a date or time, include the event
-            if dt or time_str:
-                date_str = dt.strftime('%Y-%m-%d') if dt else "TBD"
+            if date_str or time_str:
+                date_str = date_str or "TBD"
                 time_str = time_str or "TBD"
                 events.append(f"{clean} — {date_str} at {time_str}")
 
         return "\n".join(events) if events else ""
 
-    def refine_key_info_with_gpt(self, conversation_text: str, key_info: str) -> str:
+    def _refinement_request(self, conversation_text: str, key_info: str) -> Dict:
+        """Chat completion parameters for refining one conversation's key info."""
+        system_prompt = f"{_REFINE_INSTRUCTIONS}\nHere are the events to format:\n{key_info}"
+        return {
+            "model": "gpt-3.5-turbo",
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": _conversation_context(conversation_text)}
+            ],
+            "temperature": 0.3
+        }
+
+    async def refine_key_info_with_gpt(self, conversation_text: str, key_info: str) -> str:
         if not key_info:
             return ""
-        system_prompt = (
-            "You are an expert at validating and formatting notification‐style events.\n"
-            "Below are candidate events. Please format them as follows:\n"
-            "1. Each event should be on a new line starting with a dash\n"
-            "2. Format: \"- Event Description — YYYY-MM-DD at HH:MMAM/PM\"\n"
-            "3. Times must be in 12-hour format with AM/PM\n"
-            "4. Skip events with TBD dates or times\n"
-            "5. Remove any leftover URLs or markdown\n"
-            "6. Deduplicate if there are repeats\n"
-            "Example format:\n"
-            "- Lecture 2 w/ Jason Weston — 2025-02-03 at 4:00PM\n"
-            "- Team Meeting — 2025-02-04 at 10:30AM\n"
-            f"\nHere are the events to format:\n{key_info}"
-        )
+
+        fingerprint = self._refinement_fingerprint(conversation_text, key_info)
+        cached_refined = await self._get_cached_refinement(fingerprint)
+        if cached_refined:
+            logger.info("Using cached key info refinement")
+            return cached_refined
+
         try:
-            response = openai_client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": conversation_text[:6000]}
-                ],
-                temperature=0.3
-            )
-            return response.choices[0].message.content.strip()
+            async with _openai_semaphore:
+                response = await openai_client.chat.completions.create(
+                    **self._refinement_request(conversation_text, key_info)
+                )
+            refined = response.choices[0].message.content.strip()
+        except _TRANSIENT_OPENAI_ERRORS as e:
+            logger.warning(f"OpenAI unavailable refining key info: {e}")
+            raise RefinementUnavailableError(f"Key info refinement is temporarily unavailable: {e}")
         except OpenAIError as e:
             logger.exception("OpenAI error refining key info")
             raise RuntimeError(f"Key info refinement failed: {e}")
+
+        if refined:
+            self._refined_cache.set(fingerprint, refined)
+            await asyncio.to_thread(cache.set, f"keyinfo:refined:{fingerprint}", refined, ttl=self.cache_ttl)
+        return refined
+
+    async def submit_batch(self, jobs: List[Dict[str, str]]) -> str:
+        """
+        Queue key info refinements on the OpenAI Batch API.
         
-    def generate_ics(self, refined: str) -> str:
-        ics_lines = [
-            "BEGIN:VCALENDAR",
-            "VERSION:2.0",
-            "PRODID:-//SociaMate//Calendar Events//EN",
-            "CALSCALE:GREGORIAN",
-            "METHOD:PUBLISH"
-        ]
+        Batch requests are billed at half price and use a separate rate limit
+        pool, at the cost of results arriving within 24 hours instead of
+        immediately, so this is meant for bulk, non-interactive jobs.
         
-        event_count = 0
+        Args:
+            jobs: Dicts with custom_id, conversation_text and key_info
+            
+        Returns:
+            ID of the created batch
+        """
+        requests = {}
+        fingerprints = {}
+        for job in jobs:
+            requests[job["custom_id"]] = self._refinement_request(job["conversation_text"], job["key_info"])
+            fingerprints[job["custom_id"]] = self._refinement_fingerprint(
+                job["conversation_text"], job["key_info"]
+            )
+
+        try:
+            batch_id = await submit_chat_batch(requests, "keyinfo_batch.jsonl")
+        except OpenAIError as e:
+            logger.exception("OpenAI error submitting key info batch")
+            raise RuntimeError(f"Key info batch submission failed: {e}")
+
+        # Remember which refinement each job answers so fetched results can
+        # seed the same cache the realtime path reads from
+        await asyncio.to_thread(cache.set, f"keyinfo:batch:{batch_id}", fingerprints, ttl=BATCH_TRACKING_TTL)
+        logger.info(f"Submitted key info batch {batch_id} with {len(jobs)} jobs")
+        return batch_id
+
+    async def poll_and_fetch(self, batch_id: str) -> Tuple[str, Optional[Dict[str, str]]]:
+        """
+        Check a submitted batch and download its results once complete.
+        
+        Args:
+            batch_id: ID returned by submit_batch
+            
+        Returns:
+            The batch status, and refined events keyed by custom_id when the
+            batch has completed (None otherwise)
+        """
+        try:
+            status, completions = await fetch_chat_batch(batch_id)
+        except OpenAIError as e:
+            logger.exception("OpenAI error fetching key info batch")
+            raise RuntimeError(f"Key info batch fetch failed: {e}")
+        if completions is None:
+            return status, None
+
+        fingerprints = await asyncio.to_thread(cache.get, f"keyinfo:batch:{batch_id}") or {}
+
+        refinements = {}
+        for custom_id, refined in completions.items():
+            fingerprint = fingerprints.get(custom_id)
+            if refined and fingerprint:
+                self._refined_cache.set(fingerprint, refined)
+                refinements[f"keyinfo:refined:{fingerprint}"] = refined
+        if refinements:
+            await asyncio.to_thread(cache.mset, refinements, ttl=self.cache_ttl)
+
+        return status, completions
+        
+    def parse_refined_events(self, refined: str) -> List[Tuple[str, datetime]]:
+        """
+        Parse refined key info into (description, start) pairs.
+        
+        Args:
+            refined: Output of refine_key_info_with_gpt, one event per line
+            
+        Returns:
+            Parsed events; lines not in the expected format are skipped
+        """
+        events = []
         for line in refined.splitlines():
             # Match the exact format from refine_key_info_with_gpt
-            m = re.match(
-                r"^-\s*(.+?)\s*—\s*(\d{4}-\d{2}-\d{2})\s+at\s+(\d{1,2}:\d{2})(AM|PM)$",
-                line.strip()
-            )
+            m = _ICS_EVENT_LINE_RE.match(line.strip())
             if not m:
                 logger.warning(f"Could not parse event line: {line}")
                 continue
                 
             desc, date, time_part, ampm = m.groups()
+            # The line regex pins the format, so skip dateparser entirely
             try:
-                dt = parse_date(f"{date} {time_part}{ampm}")
-                if not dt:
-                    logger.warning(f"Could not parse date/time: {date} {time_part}{ampm}")
-                    continue
-                    
-                # Convert to UTC
-                dt = dt.astimezone(datetime.now().astimezone().tzinfo)
-                # Add 1 hour for the event duration
-                end_dt = dt + timedelta(hours=1)
-                
-                # Format timestamps in UTC
-                start_stamp = dt.strftime("%Y%m%dT%H%M%SZ")
-                end_stamp = end_dt.strftime("%Y%m%dT%H%M%SZ")
-                created_stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
-                
-                ics_lines += [
-                    "BEGIN:VEVENT",
-                    f"DTSTAMP:{created_stamp}",
-                    f"DTSTART:{start_stamp}",
-                    f"DTEND:{end_stamp}",
-                    f"SUMMARY:{desc}",
-                    "SEQUENCE:0",
-                    "STATUS:CONFIRMED",
-                    "TRANSP:OPAQUE",
-                    "END:VEVENT"
-                ]
-                event_count += 1
-                logger.info(f"Successfully added event: {desc} at {dt}")
-            except Exception as e:
-                logger.error(f"Error processing event: {e}")
+                dt = datetime.strptime(f"{date} {time_part}{ampm}", _ICS_EVENT_TIME_FORMAT)
+            except ValueError:
+                logger.warning(f"Could not parse date/time: {date} {time_part}{ampm}")
                 continue
+            events.append((desc, dt))
+        return events
+        
+    def generate_ics(self, refined: str) -> str:
+        # Same refined events always map to the same file, so repeated
+        # refinements reuse it instead of writing a new one
+        digest = hashlib.blake2b(refined.encode("utf-8"), digest_size=12).hexdigest()
+        filename = f"events_{digest}.ics"
+        if filename in self._ics_cache:
+            return filename
+        filepath = os.path.join(ICS_DIR, filename)
+        if os.path.exists(filepath):
+            return filename
 
-        if event_count == 0:
+        events = self.parse_refined_events(refined)
+        if not events:
             logger.warning("No valid events found to generate ICS file")
             return ""
 
-        ics_lines.append("END:VCALENDAR")
-        content = "\n".join(ics_lines)
-        
-        # Create file in the ICS directory
-        filename = f"events_{int(time.time())}.ics"
-        filepath = os.path.join(ICS_DIR, filename)
+        content = _render_ics(events)
+        etag = hashlib.blake2b(content, digest_size=12).hexdigest()
+        self._ics_cache.set(filename, (content, etag))
         
-        with open(filepath, "w") as f:
-            f.write(content)
+        # Also write through to the ICS directory, with a sidecar ETag,
+        # for entries evicted from memory and for other worker processes. The
+        # sidecar goes first and the file is renamed into place, since other
+        # workers treat an existing file as complete
+        _write_atomic(f"{filepath}.etag", etag.encode("ascii"))
+        _write_atomic(filepath, content)
             
         return filename
\ No newline at end of file
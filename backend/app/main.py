@@ -1,22 +1,87 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.middleware.gzip import GZipResponder
+from fastapi.responses import ORJSONResponse
+import asyncio
 import logging
-import os
+import time
+from starlette.datastructures import Headers, MutableHeaders
 from app.api import router as api_router
-from app.database import init_db
+from app.database import init_db, wait_for_db
+from app.services.openai_client import warm_openai_client, close_openai_client
+from app.services.embedding import embedding_service
+from app.services.vector_store import vector_store
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Run on uvloop where available. Uvicorn's default loop setting already picks
+# it up; setting the policy here also covers other servers and workers.
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
 )
 
+class ProcessTimeMiddleware:
+    """ASGI middleware adding an X-Process-Time header (seconds to response start)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_ns = time.perf_counter_ns()
+
+        async def send_with_process_time(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Process-Time", f"{(time.perf_counter_ns() - start_ns) / 1e9:.6f}")
+            await send(message)
+
+        await self.app(scope, receive, send_with_process_time)
+
+class _EventStreamGZipResponder(GZipResponder):
+    """GZipResponder that passes Server-Sent Events through uncompressed."""
+
+    passthrough = False
+
+    async def send_with_gzip(self, message):
+        if message["type"] == "http.response.start":
+            content_type = Headers(raw=message["headers"]).get("content-type", "")
+            self.passthrough = content_type.startswith("text/event-stream")
+        if self.passthrough:
+            await self.send(message)
+        else:
+            await super().send_with_gzip(message)
+
+class EventStreamSafeGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware that leaves text/event-stream responses uncompressed.
+
+    Starlette's responder holds streamed chunks in the gzip buffer until it
+    decides to flush, which would keep SSE events from reaching clients.
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and "gzip" in Headers(scope=scope).get("Accept-Encoding", ""):
+            responder = _EventStreamGZipResponder(self.app, self.minimum_size, compresslevel=self.compresslevel)
+            await responder(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
 # Create FastAPI app
-app = FastAPI(title="SociaMate API")
+app = FastAPI(title="SociaMate API", default_response_class=ORJSONResponse)
 
 # Configure CORS middleware
 app.add_middleware(
@@ -27,12 +92,41 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress larger text responses (message lists, contexts, ICS files), but
+# not the SSE streams
+app.add_middleware(EventStreamSafeGZipMiddleware, minimum_size=512)
+
+# Report server-side processing time for every request
+app.add_middleware(ProcessTimeMiddleware)
+
 # Include API routes
 app.include_router(api_router)
 
+# The event loop only keeps weak references to tasks, so background startup
+# work is held here until it finishes
+_background_tasks = set()
+
+def _run_in_background(coro) -> None:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
 # Initialize database tables on startup
 @app.on_event("startup")
 async def on_startup():
-    # Initialize database 
-    init_db()
-    logging.info("Database initialized")
\ No newline at end of file
+    # Wait for the database, then initialize it; both block, so they run in
+    # a worker thread
+    await asyncio.to_thread(wait_for_db)
+    await asyncio.to_thread(init_db)
+    logging.info("Database initialized")
+    # Warm the OpenAI and embedding connections and load the busiest
+    # conversations' indexes in the background, so first requests don't pay
+    # for handshakes and disk reads
+    _run_in_background(warm_openai_client())
+    _run_in_background(asyncio.to_thread(embedding_service.warm_up))
+    _run_in_background(asyncio.to_thread(vector_store.warm_up))
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    # Release pooled OpenAI connections
+    await close_openai_client()
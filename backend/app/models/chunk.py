@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Text, Float
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Text, Float, Index
 from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -8,9 +8,21 @@ Base = declarative_base()
 class MessageChunk(Base):
     """Model for storing chunked conversations with embeddings."""
     __tablename__ = "message_chunks"
+    __table_args__ = (
+        # Serves per-conversation scans and deletes in chunk order
+        Index("ix_message_chunks_conversation_id_chunk_index", "conversation_id", "chunk_index"),
+        # Serves the most recent chunks per conversation; carrying the id makes
+        # the chunk id lookup for new summaries an index-only scan
+        Index(
+            "ix_message_chunks_conversation_id_end_time",
+            "conversation_id",
+            "end_time",
+            postgresql_include=["id"]
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    conversation_id = Column(String, index=True, nullable=False)
+    conversation_id = Column(String, nullable=False)
     chunk_index = Column(Integer, nullable=False)
     content = Column(Text, nullable=False)
     embedding_id = Column(String, nullable=True)  # ID for vector store lookup
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Text
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Text, Index
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -8,12 +8,16 @@ Base = declarative_base()
 class Message(Base):
     """Message model for storing chat messages."""
     __tablename__ = "messages"
+    __table_args__ = (
+        # Serves conversation lookups ordered by timestamp without a sort
+        Index("ix_messages_conversation_id_timestamp", "conversation_id", "timestamp"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    conversation_id = Column(String, index=True, nullable=False)
+    conversation_id = Column(String, nullable=False)
     author = Column(String, nullable=False)
     content = Column(Text, nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
+    timestamp = Column(DateTime, default=datetime.utcnow)
     meta_data = Column(JSONB, nullable=True)
     
     def to_dict(self):
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, DateTime, Text, Boolean
+from sqlalchemy import Column, String, Integer, DateTime, Text, Boolean, Index
 from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -8,9 +8,13 @@ Base = declarative_base()
 class Summary(Base):
     """Model for storing conversation summaries."""
     __tablename__ = "summaries"
+    __table_args__ = (
+        # Serves the latest-summary lookup per conversation without a sort
+        Index("ix_summaries_conversation_id_timestamp", "conversation_id", "timestamp"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    conversation_id = Column(String, index=True, nullable=False)
+    conversation_id = Column(String, nullable=False)
     content = Column(Text, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
     chunk_ids = Column(ARRAY(Integer), nullable=True)  # Which chunks were used
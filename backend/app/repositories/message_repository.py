@@ -4,18 +4,24 @@ Repository for message operations.
 import uuid
 import time
 import logging
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from datetime import datetime
+from sqlalchemy import insert, select, update, func
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.message import Message
 from app.models.chunk import MessageChunk
 from app.services.chunker import chunker
 from app.services.embedding import embedding_service
 from app.services.vector_store import vector_store
 from app.services.cache import cache
+from app.services.context import context_service
 
 logger = logging.getLogger(__name__)
 
+# Returned by _plan_incremental_chunking when there is nothing to re-chunk
+_UP_TO_DATE = object()
+
 class MessageRepository:
     """Repository for message operations."""
     
@@ -44,6 +50,63 @@ class MessageRepository:
             .all()
         )
         
+    def get_conversation_version(
+        self, 
+        db: Session, 
+        conversation_id: str
+    ) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Get the latest message ID and chunk ID of a conversation in one query.
+        
+        The pair changes whenever a message is added or the conversation is
+        re-chunked, so it can key caches of derived data.
+        """
+        last_message_id = (
+            select(func.max(Message.id))
+            .where(Message.conversation_id == conversation_id)
+            .scalar_subquery()
+        )
+        last_chunk_id = (
+            select(func.max(MessageChunk.id))
+            .where(MessageChunk.conversation_id == conversation_id)
+            .scalar_subquery()
+        )
+        return tuple(db.execute(select(last_message_id, last_chunk_id)).one())
+        
+    async def get_message_dicts_async(
+        self, 
+        db: AsyncSession, 
+        conversation_id: str,
+        skip: int = 0,
+        limit: int = 100
+    ) -> List[Dict[str, Any]]:
+        """Get messages for a conversation as plain dictionaries using an async session."""
+        result = await db.execute(
+            select(
+                Message.id,
+                Message.conversation_id,
+                Message.author,
+                Message.content,
+                Message.timestamp,
+                Message.meta_data
+            )
+            .where(Message.conversation_id == conversation_id)
+            .order_by(Message.timestamp)
+            .offset(skip)
+            .limit(limit)
+        )
+        return [
+            {
+                "id": row.id,
+                "conversation_id": row.conversation_id,
+                "author": row.author,
+                "content": row.content,
+                "timestamp": row.timestamp,
+                "metadata": row.meta_data or {}
+            }
+            for row in result
+        ]
+        
     def create_message(
         self, 
         db: Session, 
@@ -56,22 +119,25 @@ class MessageRepository:
         """Create a new message."""
         timestamp = timestamp or datetime.utcnow()
         
-        message = Message(
-            conversation_id=conversation_id,
-            author=author,
-            content=content,
-            timestamp=timestamp,
-            meta_data=metadata
-        )
-        
         start_time = time.time()
         
-        db.add(message)
+        # INSERT ... RETURNING hands back the populated row, so there is no
+        # follow-up SELECT to refresh it after the commit
+        message = db.scalars(
+            insert(Message).returning(Message),
+            [{
+                "conversation_id": conversation_id,
+                "author": author,
+                "content": content,
+                "timestamp": timestamp,
+                "meta_data": metadata
+            }]
+        ).one()
         db.commit()
-        db.refresh(message)
         
         # Invalidate conversation cache
         cache.invalidate_conversation(conversation_id)
+        context_service.invalidate_local(conversation_id)
         
         logger.info(f"Created message in {time.time() - start_time:.4f}s")
         
@@ -100,46 +166,69 @@ class MessageRepository:
         """
         start_time = time.time()
         
-        messages = []
-        for message_data in messages_data:
-            timestamp = message_data.get("timestamp") or datetime.utcnow()
+        if not messages_data:
+            return []
             
-            message = Message(
-                conversation_id=conversation_id,
-                author=message_data["author"],
-                content=message_data["content"],
-                timestamp=timestamp,
-                meta_data=message_data.get("metadata")
-            )
-            
-            messages.append(message)
+        now = datetime.utcnow()
+        rows = [
+            {
+                "conversation_id": conversation_id,
+                "author": message_data["author"],
+                "content": message_data["content"],
+                "timestamp": message_data.get("timestamp") or now,
+                "meta_data": message_data.get("metadata")
+            }
+            for message_data in messages_data
+        ]
             
-        # Bulk insert
-        db.add_all(messages)
+        # Bulk insert in a single INSERT ... RETURNING round trip (SQLAlchemy
+        # pages very large uploads via insertmanyvalues), so the created rows
+        # come back populated without a refresh per message
+        messages = db.scalars(insert(Message).returning(Message), rows).all()
         db.commit()
-        
-        for message in messages:
-            db.refresh(message)
             
-        # Process chunks and invalidate cache
-        self._process_conversation_chunks(db, conversation_id)
+        # Invalidate conversation cache; chunking is left to the caller to
+        # schedule off the request path
         cache.invalidate_conversation(conversation_id)
+        context_service.invalidate_local(conversation_id)
         
         logger.info(f"Created {len(messages)} messages in {time.time() - start_time:.4f}s")
         
         return messages
         
-    def _process_conversation_chunks(self, db: Session, conversation_id: str):
+    def process_conversation_chunks(
+        self, 
+        db: Session, 
+        conversation_id: str,
+        full_rebuild: bool = False
+    ):
         """
         Process conversation messages into chunks and update embeddings.
         
-        This is called after adding messages to a conversation.
+        This is scheduled in the background after adding messages to a conversation.
+        Messages are normally appended in time order, so only the last chunk
+        and the new messages after it are re-chunked and re-embedded; the
+        whole conversation is rebuilt when that doesn't hold.
+        
+        Args:
+            db: Database session
+            conversation_id: ID of the conversation
+            full_rebuild: Re-chunk every message even if an incremental
+                update would do (e.g. after changing the chunker config)
         """
-        # Get all messages for the conversation
+        resume = None if full_rebuild else self._plan_incremental_chunking(db, conversation_id)
+        if resume is _UP_TO_DATE:
+            logger.info(f"Chunks already up to date for conversation {conversation_id}")
+            return
+        start_index, offset, carried = resume or (0, 0, 0)
+        
+        # Get the messages to chunk: everything, or the last chunk's messages
+        # and any newer ones
         messages = (
             db.query(Message)
             .filter(Message.conversation_id == conversation_id)
-            .order_by(Message.timestamp)
+            .order_by(Message.timestamp, Message.id)
+            .offset(offset)
             .all()
         )
         
@@ -147,44 +236,108 @@ class MessageRepository:
             logger.warning(f"No messages found for conversation {conversation_id}")
             return
             
-        # Delete existing chunks for the conversation
+        # Delete the chunks being rebuilt and drop their vectors from searches
+        replaced_ids = db.scalars(
+            select(MessageChunk.id).where(
+                MessageChunk.conversation_id == conversation_id,
+                MessageChunk.chunk_index >= start_index
+            )
+        ).all()
         db.query(MessageChunk).filter(
-            MessageChunk.conversation_id == conversation_id
+            MessageChunk.conversation_id == conversation_id,
+            MessageChunk.chunk_index >= start_index
         ).delete()
+        if start_index == 0:
+            vector_store.delete_conversation_embeddings(conversation_id)
+        else:
+            vector_store.discard_chunks(conversation_id, replaced_ids)
         
         # Create new chunks
-        chunks = chunker.chunk_conversation(messages, conversation_id)
+        chunks = chunker.chunk_conversation(
+            messages, 
+            conversation_id, 
+            start_index=start_index,
+            carried_messages=carried
+        )
         
         if not chunks:
             logger.warning(f"No chunks created for conversation {conversation_id}")
             return
             
-        # Add chunks to database
-        for chunk in chunks:
-            db.add(chunk)
-            
+        # Add chunks to database; the flush inserts them in one batched
+        # INSERT ... RETURNING that also fills in their ids
+        db.add_all(chunks)
+        db.flush()
+        chunk_rows = [(chunk.id, chunk.content) for chunk in chunks]
         db.commit()
         
-        # Generate embeddings for chunks
-        for chunk in chunks:
-            db.refresh(chunk)
-            embedding = embedding_service.generate_embedding(chunk.content)
-            
-            if embedding:
-                # Add to vector store
-                embedding_id = vector_store.add_embedding(
-                    embedding, 
-                    conversation_id, 
-                    chunk.id
-                )
-                
-                # Update chunk with embedding ID
-                chunk.embedding_id = embedding_id
-                db.add(chunk)
+        # Generate embeddings for all chunks in batched API requests and add
+        # them to the vector store with a single index write
+        chunk_ids = [chunk_id for chunk_id, _ in chunk_rows]
+        embeddings = embedding_service.batch_generate_embeddings(
+            [content for _, content in chunk_rows]
+        )
+        embedding_ids = vector_store.add_embeddings(embeddings, conversation_id, chunk_ids)
+        embedding_updates = [
+            {"id": chunk_id, "embedding_id": embedding_id}
+            for chunk_id, embedding_id in zip(chunk_ids, embedding_ids)
+            if embedding_id is not None
+        ]
                 
+        # Update all chunks with their embedding IDs in one executemany
+        if embedding_updates:
+            db.execute(update(MessageChunk), embedding_updates)
         db.commit()
         
-        logger.info(f"Processed {len(chunks)} chunks for conversation {conversation_id}")
+        logger.info(
+            f"Processed {len(chunks)} chunks for conversation {conversation_id} "
+            f"starting at chunk {start_index}"
+        )
+        
+    def _plan_incremental_chunking(self, db: Session, conversation_id: str):
+        """
+        Work out where to resume chunking a conversation.
+        
+        Returns:
+            (start_index, message_offset, carried_messages) to rebuild from the
+            last chunk, _UP_TO_DATE if no messages were added since the last
+            run, or None if the conversation needs a full rebuild
+        """
+        existing = db.execute(
+            select(MessageChunk.chunk_index, MessageChunk.message_count, MessageChunk.end_time)
+            .where(MessageChunk.conversation_id == conversation_id)
+            .order_by(MessageChunk.chunk_index)
+        ).all()
+        if not existing:
+            return None
+            
+        # Replay where each chunk started: a chunk carries over the last
+        # overlap_messages messages of the one before it
+        overlap = chunker.config.overlap_messages
+        offset = carried = previous_count = 0
+        for position, (chunk_index, message_count, _) in enumerate(existing):
+            if chunk_index != position:
+                return None
+            if position:
+                carried = min(overlap, previous_count)
+                offset += previous_count - carried
+            previous_count = message_count
+        last_index, last_count, last_end = existing[-1]
+        chunked_count = offset + last_count
+        
+        # Everything chunked so far is at or before the last chunk's end, so
+        # an append-only history has exactly that many messages up to it
+        total, up_to_last_end = db.execute(
+            select(
+                func.count(),
+                func.count().filter(Message.timestamp <= last_end)
+            ).where(Message.conversation_id == conversation_id)
+        ).one()
+        if up_to_last_end != chunked_count:
+            return None
+        if total == chunked_count:
+            return _UP_TO_DATE
+        return last_index, offset, carried
 
 # Global repository instance
 message_repository = MessageRepository() 
\ No newline at end of file
@@ -2,10 +2,13 @@
 Redis cache service for caching embeddings and summaries.
 """
 import redis
-import json
+import orjson
 import os
+import atexit
 import logging
-from typing import Any, Optional, Dict, List
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Dict, List, Hashable
 from dotenv import load_dotenv
 import time
 
@@ -13,6 +16,31 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Prefixes marking orjson-encoded values and raw bytes values; anything else
+# is a legacy plain string
+_ENCODED_PREFIX = b"\x01"
+_BYTES_PREFIX = b"\x02"
+
+# Keys per SCAN page and per pipelined UNLINK round trip
+_INVALIDATE_BATCH_SIZE = 500
+
+def _encode(value: Any) -> bytes:
+    if isinstance(value, bytes):
+        return _BYTES_PREFIX + value
+    return _ENCODED_PREFIX + orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY)
+
+def _decode(raw: Optional[bytes]) -> Optional[Any]:
+    if not raw:
+        return None
+    if raw[:1] == _BYTES_PREFIX:
+        return raw[1:]
+    if raw[:1] == _ENCODED_PREFIX:
+        try:
+            return orjson.loads(raw[1:])
+        except orjson.JSONDecodeError:
+            pass
+    return raw.decode('utf-8')
+
 class RedisCache:
     """Redis cache service."""
     
@@ -33,20 +61,34 @@ class RedisCache:
         self.db = db
         self.ttl = ttl
         
+        self.pool = None
+        
         try:
-            self.client = redis.Redis(
+            # Concurrent requests each check out a pooled connection; once the
+            # pool is exhausted callers wait briefly instead of opening more
+            self.pool = redis.BlockingConnectionPool(
                 host=self.host,
                 port=self.port,
                 password=self.password,
                 db=self.db,
-                decode_responses=True
+                max_connections=int(os.getenv("REDIS_POOL_SIZE", "32")),
+                timeout=5,
+                socket_keepalive=True,
+                decode_responses=False
             )
+            self.client = redis.Redis(connection_pool=self.pool)
+            atexit.register(self.close)
             logger.info("Connected to Redis")
         except Exception as e:
             logger.exception(f"Failed to connect to Redis: {str(e)}")
             self.client = None
     
-    def get(self, key: str) -> Optional[str]:
+    def close(self) -> None:
+        """Close all pooled connections."""
+        if self.pool:
+            self.pool.disconnect()
+    
+    def get(self, key: str) -> Optional[Any]:
         """
         Get a value from the cache.
         
@@ -54,25 +96,21 @@ class RedisCache:
             key: Cache key
             
         Returns:
-            Cached value, or None if not found
+            Cached value as it was passed to set, or None if not found
         """
         if not self.client:
             return None
             
         try:
-            start_time = time.time()
+            # Only time the call when the result would actually be logged
+            if not logger.isEnabledFor(logging.DEBUG):
+                return _decode(self.client.get(key))
+                
+            start_ns = time.perf_counter_ns()
             value = self.client.get(key)
-            elapsed = time.time() - start_time
-            
-            logger.debug(f"Cache get for '{key}' took {elapsed:.4f}s")
+            logger.debug(f"Cache get for '{key}' took {(time.perf_counter_ns() - start_ns) / 1e9:.4f}s")
             
-            if value:
-                try:
-                    return value.decode('utf-8')
-                except json.JSONDecodeError:
-                    return value
-            
-            return None
+            return _decode(value)
         except redis.exceptions.ConnectionError as e:
             logger.warning(f"Redis connection failed, proceeding without cache: {e}")
             return None
@@ -80,13 +118,14 @@ class RedisCache:
             logger.error(f"Error getting from cache: {e}")
             return None
     
-    def set(self, key: str, value: str, ttl: Optional[int] = None) -> bool:
+    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
         """
         Set a value in the cache.
         
         Args:
             key: Cache key
-            value: Value to cache
+            value: JSON-serializable value to cache (numpy arrays are stored as
+                lists), or bytes to store as-is
             ttl: TTL in seconds, or None to use default
             
         Returns:
@@ -98,16 +137,12 @@ class RedisCache:
         ttl = ttl if ttl is not None else self.ttl
         
         try:
-            start_time = time.time()
-            
-            # Convert non-string values to JSON
-            if not isinstance(value, str):
-                value = json.dumps(value)
+            if not logger.isEnabledFor(logging.DEBUG):
+                return bool(self.client.set(key, _encode(value), ex=ttl))
                 
-            result = self.client.set(key, value, ex=ttl)
-            
-            elapsed = time.time() - start_time
-            logger.debug(f"Cache set for '{key}' took {elapsed:.4f}s")
+            start_ns = time.perf_counter_ns()
+            result = self.client.set(key, _encode(value), ex=ttl)
+            logger.debug(f"Cache set for '{key}' took {(time.perf_counter_ns() - start_ns) / 1e9:.4f}s")
             
             return bool(result)
         except redis.exceptions.ConnectionError as e:
@@ -117,6 +152,59 @@ class RedisCache:
             logger.error(f"Error setting cache: {e}")
             return False
     
+    def mget(self, keys: List[str]) -> List[Optional[Any]]:
+        """
+        Get several values from the cache in one round trip.
+        
+        Args:
+            keys: Cache keys
+            
+        Returns:
+            Cached values in the order of keys, with None for misses
+        """
+        if not self.client or not keys:
+            return [None] * len(keys)
+            
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for key in keys:
+                pipe.get(key)
+            return [_decode(raw) for raw in pipe.execute()]
+        except redis.exceptions.ConnectionError as e:
+            logger.warning(f"Redis connection failed, proceeding without cache: {e}")
+            return [None] * len(keys)
+        except Exception as e:
+            logger.error(f"Error getting from cache: {e}")
+            return [None] * len(keys)
+    
+    def mset(self, mapping: Dict[str, Any], ttl: Optional[int] = None) -> bool:
+        """
+        Set several values in the cache in one round trip.
+        
+        Args:
+            mapping: Cache keys to values
+            ttl: TTL in seconds, or None to use default
+            
+        Returns:
+            True if successful, False otherwise
+        """
+        if not self.client or not mapping:
+            return False
+            
+        ttl = ttl if ttl is not None else self.ttl
+        
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for key, value in mapping.items():
+                pipe.set(key, _encode(value), ex=ttl)
+            return all(pipe.execute())
+        except redis.exceptions.ConnectionError as e:
+            logger.warning(f"Redis connection failed, proceeding without cache: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"Error setting cache: {e}")
+            return False
+    
     def delete(self, key: str) -> bool:
         """
         Delete a value from the cache.
@@ -136,6 +224,37 @@ class RedisCache:
             logger.exception(f"Error deleting from cache: {str(e)}")
             return False
     
+    def pop(self, key: str) -> Optional[Any]:
+        """
+        Get a value and delete it in one atomic step.
+        
+        Of several concurrent callers, only one gets the value.
+        
+        Args:
+            key: Cache key
+            
+        Returns:
+            The value that was cached, or None if not found or the cache is
+            unreachable (the value is then left in place)
+        """
+        if not self.client:
+            return None
+            
+        try:
+            # GET and DEL in one MULTI/EXEC transaction; unlike GETDEL this
+            # also works on Redis servers older than 6.2
+            pipe = self.client.pipeline(transaction=True)
+            pipe.get(key)
+            pipe.delete(key)
+            raw, _ = pipe.execute()
+            return _decode(raw)
+        except redis.exceptions.ConnectionError as e:
+            logger.warning(f"Redis connection failed, proceeding without cache: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Error popping from cache: {e}")
+            return None
+    
     def exists(self, key: str) -> bool:
         """
         Check if a key exists in the cache.
@@ -168,17 +287,92 @@ class RedisCache:
         if not self.client:
             return 0
             
+        deleted = 0
         try:
             pattern = f"conversation:{conversation_id}:*"
-            keys = self.client.keys(pattern)
-            
-            if not keys:
-                return 0
-                
-            return self.client.delete(*keys)
+            # SCAN walks the keyspace incrementally instead of blocking the
+            # server like KEYS, and UNLINK frees the values in the background
+            pipe = self.client.pipeline(transaction=False)
+            pending = 0
+            for key in self.client.scan_iter(match=pattern, count=_INVALIDATE_BATCH_SIZE):
+                pipe.unlink(key)
+                pending += 1
+                if pending >= _INVALIDATE_BATCH_SIZE:
+                    deleted += sum(pipe.execute())
+                    pending = 0
+            if pending:
+                deleted += sum(pipe.execute())
+            return deleted
         except Exception as e:
             logger.exception(f"Error invalidating conversation: {str(e)}")
-            return 0
+            return deleted
+
+class LocalCache:
+    """Thread-safe in-process LRU cache with per-entry TTL."""
+    
+    def __init__(self, maxsize: int = 1024, ttl: Optional[int] = 3600):
+        """
+        Initialize the local cache.
+        
+        Args:
+            maxsize: Maximum number of entries before the least recently used is evicted
+            ttl: Default TTL for entries in seconds, or None for no expiry
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at or None, value)
+        self._lock = threading.Lock()
+    
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Get a value from the cache.
+        
+        Args:
+            key: Cache key
+            
+        Returns:
+            Cached value, or None if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+    
+    def set(self, key: Hashable, value: Any, ttl: Optional[int] = None) -> None:
+        """
+        Set a value in the cache.
+        
+        Args:
+            key: Cache key
+            value: Value to cache
+            ttl: TTL in seconds, or None to use the default
+        """
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def delete(self, key: Hashable) -> None:
+        """Remove an entry if present."""
+        with self._lock:
+            self._entries.pop(key, None)
+    
+    def clear(self) -> None:
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+    
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
 
 # Global cache instance
 cache = RedisCache() 
\ No newline at end of file
@@ -1,6 +1,7 @@
 """
 Chunking service for breaking conversations into manageable pieces.
 """
+from collections import Counter
 from datetime import datetime
 from app.models.message import Message
 from app.models.chunk import MessageChunk
@@ -28,13 +29,19 @@ class ChunkerService:
         """Initialize the chunker with the given configuration."""
         self.config = config or ChunkerConfig()
     
-    def chunk_conversation(self, messages, conversation_id):
+    def chunk_conversation(self, messages, conversation_id, start_index=0, carried_messages=0):
         """
         Split a list of messages into chunks based on token count and message count.
         
         Args:
             messages: List of Message objects, sorted by timestamp
             conversation_id: ID of the conversation
+            start_index: Index of the first chunk produced, when resuming
+                chunking partway through a conversation
+            carried_messages: Number of leading messages that are overlap
+                carried over from the previous chunk; together with the
+                message after them they seed the first chunk exactly as
+                they would mid-way through a full run
             
         Returns:
             List of MessageChunk objects
@@ -42,68 +49,87 @@ class ChunkerService:
         if not messages:
             return []
             
+        # The message after the carried overlap is the one that closed the
+        # previous chunk, which joins the new chunk without a limit check
+        seeded = carried_messages + 1 if carried_messages else 0
+        
+        # Tokenize every message once up front; chunk totals, including the
+        # overlap carried into each new chunk, are sums over these counts
+        token_counts = tokenizer.count_tokens_batch([m.content for m in messages])
+        # Likewise render each message once, since overlapping messages
+        # appear in more than one chunk
+        rendered = [f"{m.author}: {m.content}" for m in messages]
+        
         chunks = []
-        current_chunk_messages = []
-        current_chunk_token_count = 0
-        current_authors = set()
-        chunk_index = 0
+        current_indices = list(range(min(seeded, len(messages))))
+        current_chunk_token_count = sum(token_counts[i] for i in current_indices)
+        # Messages per author in the current chunk, so authors and token
+        # totals are updated for just the messages evicted at a boundary
+        author_counts = Counter(messages[i].author for i in current_indices)
+        chunk_index = start_index
         
-        for message in messages:
-            message_token_count = tokenizer.count_tokens(message.content)
+        for i in range(len(current_indices), len(messages)):
+            message = messages[i]
+            message_token_count = token_counts[i]
             
             # Check if adding this message would exceed limits
             if (current_chunk_token_count + message_token_count > self.config.max_chunk_tokens or
-                len(current_chunk_messages) >= self.config.max_chunk_messages) and current_chunk_messages:
+                len(current_indices) >= self.config.max_chunk_messages) and current_indices:
                 
                 # Create a chunk from the current messages
                 chunk = self._create_chunk(
-                    current_chunk_messages, 
+                    messages,
+                    rendered,
+                    current_indices,
                     conversation_id, 
                     chunk_index,
                     current_chunk_token_count,
-                    list(current_authors)
+                    list(author_counts)
                 )
                 chunks.append(chunk)
                 
                 # Start a new chunk with overlap
-                overlap_start = max(0, len(current_chunk_messages) - self.config.overlap_messages)
-                current_chunk_messages = current_chunk_messages[overlap_start:]
-                current_chunk_token_count = sum(tokenizer.count_tokens(m.content) for m in current_chunk_messages)
-                current_authors = set(m.author for m in current_chunk_messages)
+                overlap_start = max(0, len(current_indices) - self.config.overlap_messages)
+                for j in current_indices[:overlap_start]:
+                    current_chunk_token_count -= token_counts[j]
+                    author = messages[j].author
+                    author_counts[author] -= 1
+                    if not author_counts[author]:
+                        del author_counts[author]
+                current_indices = current_indices[overlap_start:]
                 chunk_index += 1
             
             # Add the message to the current chunk
-            current_chunk_messages.append(message)
+            current_indices.append(i)
             current_chunk_token_count += message_token_count
-            current_authors.add(message.author)
+            author_counts[message.author] += 1
         
         # Create a final chunk if there are remaining messages
-        if current_chunk_messages:
+        if current_indices:
             chunk = self._create_chunk(
-                current_chunk_messages, 
+                messages,
+                rendered,
+                current_indices,
                 conversation_id, 
                 chunk_index,
                 current_chunk_token_count,
-                list(current_authors)
+                list(author_counts)
             )
             chunks.append(chunk)
         
         return chunks
     
-    def _create_chunk(self, messages, conversation_id, chunk_index, token_count, authors):
-        """Create a MessageChunk from a list of messages."""
-        if not messages:
+    def _create_chunk(self, messages, rendered, indices, conversation_id, chunk_index, token_count, authors):
+        """Create a MessageChunk from the messages at the given indices."""
+        if not indices:
             return None
             
         # Concatenate all messages into a single string
-        content = "\n\n".join([
-            f"{message.author}: {message.content}" 
-            for message in messages
-        ])
+        content = "\n\n".join([rendered[i] for i in indices])
         
-        # Get start and end times
-        start_time = min(message.timestamp for message in messages)
-        end_time = max(message.timestamp for message in messages)
+        # Messages are sorted, so the first and last give the time span
+        start_time = messages[indices[0]].timestamp
+        end_time = messages[indices[-1]].timestamp
         
         return MessageChunk(
             conversation_id=conversation_id,
@@ -112,7 +138,7 @@ class ChunkerService:
             start_time=start_time,
             end_time=end_time,
             token_count=token_count,
-            message_count=len(messages),
+            message_count=len(indices),
             authors=authors
         )
 
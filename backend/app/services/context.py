@@ -1,18 +1,30 @@
 """
 Context service for retrieving relevant context for a conversation.
 """
+import bisect
+import hashlib
+import itertools
 import logging
 import time
 from typing import List, Dict, Any, Optional, Tuple
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from app.models.message import Message
 from app.models.chunk import MessageChunk
 from app.services.vector_store import vector_store
-from app.services.cache import cache
+from app.services.cache import cache, LocalCache
 from app.services.tokenizer import tokenizer
 
 logger = logging.getLogger(__name__)
 
+# Query-specific contexts are reused briefly, since the same question tends
+# to be asked repeatedly while a conversation is active
+QUERY_CONTEXT_TTL = 300
+
+# Default for get_context's latest_chunk_id when the caller hasn't looked it up
+# (None is a valid answer, for a conversation without chunks)
+_LOOKUP = object()
+
 class ContextService:
     """Service for retrieving relevant context from a conversation."""
     
@@ -28,13 +40,21 @@ class ContextService:
         self.top_k = top_k
         self.max_tokens = max_tokens
         self.cache_ttl = cache_ttl
+        # Recent contexts served from this process without a Redis round
+        # trip; kept briefly since other workers' writes only clear Redis
+        self._local_cache = LocalCache(maxsize=1024, ttl=30)
+    
+    def invalidate_local(self, conversation_id: str) -> None:
+        """Drop this process's cached context for a conversation."""
+        self._local_cache.delete(conversation_id)
     
     def get_context(
         self, 
         db: Session, 
         conversation_id: str, 
         query_text: Optional[str] = None,
-        use_cache: bool = True
+        use_cache: bool = True,
+        latest_chunk_id: Any = _LOOKUP
     ) -> str:
         """
         Get conversation context based on a query.
@@ -44,6 +64,8 @@ class ContextService:
             conversation_id: ID of the conversation
             query_text: Query text to find relevant context, or None for recent
             use_cache: Whether to use cached context
+            latest_chunk_id: The conversation's latest chunk ID (None if it has
+                none), when the caller already has it; looked up otherwise
             
         Returns:
             Context string containing relevant conversation chunks
@@ -53,9 +75,28 @@ class ContextService:
         # Try to get cached context if no specific query is provided
         cache_key = f"conversation:{conversation_id}:context"
         if use_cache and not query_text:
+            cached_context = self._local_cache.get(conversation_id)
+            if cached_context:
+                return cached_context
             cached_context = cache.get(cache_key)
             if cached_context:
                 logger.info(f"Using cached context for conversation {conversation_id}")
+                self._local_cache.set(conversation_id, cached_context)
+                return cached_context
+                
+        # Semantic contexts are cached per query; the latest chunk ID in the
+        # key makes re-chunking miss rather than serve stale chunks
+        query_cache_key = None
+        if use_cache and query_text:
+            if latest_chunk_id is _LOOKUP:
+                latest_chunk_id = db.query(func.max(MessageChunk.id)).filter(
+                    MessageChunk.conversation_id == conversation_id
+                ).scalar()
+            query_hash = hashlib.blake2b(query_text.encode("utf-8"), digest_size=8).hexdigest()
+            query_cache_key = f"conversation:{conversation_id}:context:{query_hash}:{latest_chunk_id}"
+            cached_context = cache.get(query_cache_key)
+            if cached_context:
+                logger.info(f"Using cached query context for conversation {conversation_id}")
                 return cached_context
         
         try:
@@ -67,9 +108,12 @@ class ContextService:
                 # Get recent chunks
                 context = self._get_chronological_context(db, conversation_id)
                 
-            # Cache the context if no specific query was provided
+            # Cache the context; query-specific ones only briefly
             if use_cache and not query_text:
                 cache.set(cache_key, context, ttl=self.cache_ttl)
+                self._local_cache.set(conversation_id, context)
+            elif query_cache_key and context:
+                cache.set(query_cache_key, context, ttl=QUERY_CONTEXT_TTL)
                 
             context_time = time.time() - start_time
             logger.info(f"Context retrieval took {context_time:.2f}s")
@@ -99,32 +143,47 @@ class ContextService:
             logger.warning(f"No chunks found for query: {query_text}")
             return self._get_chronological_context(db, conversation_id)
             
-        # Get chunks from database
+        # Chunk rows never change once written, so their content and token
+        # counts are cached per chunk and fetched in one round trip
         chunk_ids = [chunk_id for chunk_id, _ in chunk_results]
-        chunks = db.query(MessageChunk).filter(
-            MessageChunk.id.in_(chunk_ids),
-            MessageChunk.conversation_id == conversation_id
-        ).all()
+        cached = cache.mget([f"conversation:{conversation_id}:chunk:{chunk_id}" for chunk_id in chunk_ids])
+        chunks = {
+            chunk_id: tuple(entry)
+            for chunk_id, entry in zip(chunk_ids, cached)
+            if entry
+        }
         
-        # Sort chunks by relevance score
-        chunks_with_scores = []
-        for chunk in chunks:
-            score = next((score for cid, score in chunk_results if cid == chunk.id), 0)
-            chunks_with_scores.append((chunk, score))
-            
-        chunks_with_scores.sort(key=lambda x: x[1], reverse=True)
+        # Get the remaining chunks from database
+        missing_ids = [chunk_id for chunk_id in chunk_ids if chunk_id not in chunks]
+        if missing_ids:
+            rows = db.query(
+                MessageChunk.id,
+                MessageChunk.content,
+                MessageChunk.token_count
+            ).filter(
+                MessageChunk.id.in_(missing_ids),
+                MessageChunk.conversation_id == conversation_id
+            ).all()
+            fetched = {row.id: (row.content, row.token_count) for row in rows}
+            chunks.update(fetched)
+            cache.mset({
+                f"conversation:{conversation_id}:chunk:{chunk_id}": list(entry)
+                for chunk_id, entry in fetched.items()
+            }, ttl=self.cache_ttl)
         
-        # Build context, respecting token limit
-        context_parts = []
-        total_tokens = 0
+        # Search results already come most relevant first
+        chunks_with_scores = [
+            (chunks[chunk_id], score)
+            for chunk_id, score in chunk_results
+            if chunk_id in chunks
+        ]
         
-        for chunk, score in chunks_with_scores:
-            if total_tokens + chunk.token_count > self.max_tokens:
-                break
-                
-            # Add chunk to context
-            context_parts.append(f"[Relevance: {score:.2f}] {chunk.content}")
-            total_tokens += chunk.token_count
+        # Build context, respecting token limit
+        cut = self._token_cutoff([token_count for (_, token_count), _ in chunks_with_scores])
+        context_parts = [
+            f"[Relevance: {score:.2f}] {content}"
+            for (content, _), score in chunks_with_scores[:cut]
+        ]
             
         # Join parts with separators
         return "\n\n==========\n\n".join(context_parts)
@@ -136,7 +195,11 @@ class ContextService:
     ) -> str:
         """Get context based on chronological order (most recent first)."""
         # Get most recent chunks
-        chunks = db.query(MessageChunk).filter(
+        chunks = db.query(
+            MessageChunk.content,
+            MessageChunk.token_count,
+            MessageChunk.start_time
+        ).filter(
             MessageChunk.conversation_id == conversation_id
         ).order_by(MessageChunk.end_time.desc()).limit(self.top_k).all()
         
@@ -148,19 +211,15 @@ class ContextService:
         chunks.sort(key=lambda x: x.start_time)
         
         # Build context, respecting token limit
-        context_parts = []
-        total_tokens = 0
-        
-        for chunk in chunks:
-            if total_tokens + chunk.token_count > self.max_tokens:
-                break
-                
-            # Add chunk to context
-            context_parts.append(chunk.content)
-            total_tokens += chunk.token_count
+        cut = self._token_cutoff([chunk.token_count for chunk in chunks])
+        context_parts = [chunk.content for chunk in chunks[:cut]]
             
         # Join parts with separators
         return "\n\n==========\n\n".join(context_parts)
 
+    def _token_cutoff(self, token_counts: List[int]) -> int:
+        """Number of leading chunks whose combined token count fits in max_tokens."""
+        return bisect.bisect_right(list(itertools.accumulate(token_counts)), self.max_tokens)
+
 # Global context service instance
 context_service = ContextService() 
\ No newline at end of file
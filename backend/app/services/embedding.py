@@ -2,13 +2,18 @@
 Embedding service for generating vector embeddings of text chunks.
 """
 import os
-import requests
+import asyncio
+import hashlib
+import threading
+import httpx
+import orjson
 import numpy as np
 import time
 from dotenv import load_dotenv
 import logging
-import json
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+from app.services.cache import cache
 
 load_dotenv()
 
@@ -18,6 +23,28 @@ logger = logging.getLogger(__name__)
 DEFAULT_EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
 HF_TOKEN = os.getenv("HF_TOKEN")
 
+# Embed in-process with an INT8 ONNX export of the model instead of calling
+# the inference API (see scripts/export_onnx_embedding.py)
+USE_LOCAL_EMBED = os.getenv("USE_LOCAL_EMBED", "0") == "1"
+LOCAL_EMBED_MODEL_DIR = os.getenv("LOCAL_EMBED_MODEL_DIR", "./data/models/bge-small-en-v1.5-int8")
+
+# Most batch requests in flight at once, one per keep-alive connection
+_MAX_BATCH_CONCURRENCY = 8
+
+# Embeddings depend only on the model and the text, so cached vectors can live
+# much longer than other cache entries
+EMBEDDING_CACHE_TTL = 7 * 24 * 3600
+
+# Returned for texts that could not be embedded
+_NO_EMBEDDING = np.empty(0, dtype=np.float32)
+_NO_EMBEDDING.flags.writeable = False
+
+def _from_cache(value: Any) -> Optional[np.ndarray]:
+    """Rebuild a cached float32 vector, or None for a miss."""
+    if not isinstance(value, bytes) or not value or len(value) % 4:
+        return None
+    return np.frombuffer(value, dtype=np.float32)
+
 class EmbeddingService:
     """Service for generating embeddings from text."""
     
@@ -27,9 +54,50 @@ class EmbeddingService:
         self.api_key = api_key or HF_TOKEN
         self.api_url = f"https://api-inference.huggingface.co/models/{self.model_name}"
         self.headers = {"Authorization": f"Bearer {self.api_key}"}
+        # One persistent HTTP/2 connection is reused across requests instead
+        # of a new TCP + TLS handshake per call; the transport retries failed
+        # connects so a dropped keep-alive connection doesn't lose an embedding
+        self.session = httpx.Client(
+            transport=httpx.HTTPTransport(
+                http2=True,
+                retries=3,
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=_MAX_BATCH_CONCURRENCY)
+            ),
+            headers={**self.headers, "Content-Type": "application/json"},
+            timeout=httpx.Timeout(60.0, connect=3.0)
+        )
+        # Long-lived threads sending concurrent batch requests over the session
+        self._batch_executor = ThreadPoolExecutor(
+            max_workers=_MAX_BATCH_CONCURRENCY,
+            thread_name_prefix="embedding-batch"
+        )
+        self.local_model = self._load_local_model() if USE_LOCAL_EMBED else None
         logger.info(f"Initialized EmbeddingService with model: {self.model_name}")
         
-    def generate_embedding(self, text: str) -> List[float]:
+    def _load_local_model(self):
+        """Load the local ONNX model, or None to fall back to the inference API."""
+        try:
+            from app.services.onnx_embedding import OnnxEmbeddingModel
+            return OnnxEmbeddingModel(LOCAL_EMBED_MODEL_DIR)
+        except Exception as e:
+            logger.exception(f"Failed to load local embedding model, using the inference API: {str(e)}")
+            return None
+            
+    def warm_up(self) -> bool:
+        """
+        Open the inference API connection, or run the local model once, ahead of real requests.
+        
+        Returns:
+            True if the model returned an embedding, False if it is unavailable
+        """
+        start_time = time.time()
+        if self._request_embedding("warm up").size:
+            logger.info(f"Embedding service warmed up in {time.time() - start_time:.2f}s")
+            return True
+        logger.warning("Embedding warm-up request failed")
+        return False
+        
+    def generate_embedding(self, text: str) -> np.ndarray:
         """
         Generate an embedding for a single text.
         
@@ -37,94 +105,273 @@ class EmbeddingService:
             text: The text to embed
             
         Returns:
-            List of floats representing the embedding vector
+            float32 embedding vector, empty if the text could not be embedded
         """
         if not text:
             logger.warning("Empty text provided for embedding")
-            return []
+            return _NO_EMBEDDING
             
-        try:
-            # Apply model-specific instruction if needed (for BGE models)
-            if "bge" in self.model_name.lower() and not text.startswith("Represent this sentence"):
-                instruction = "Represent this sentence for searching relevant passages: "
-                text = instruction + text
+        cache_key = self._cache_key(text)
+        embedding = _from_cache(cache.get(cache_key))
+        if embedding is not None:
+            return embedding
+            
+        embedding = self._request_embedding(text)
+        if embedding.size:
+            cache.set(cache_key, embedding.tobytes(), ttl=EMBEDDING_CACHE_TTL)
+        return embedding
+        
+    def _cache_key(self, text: str) -> str:
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+        return f"embedding:{self.model_name}:{digest}"
+        
+    def _request_embedding(self, text: str) -> np.ndarray:
+        """Embed a single text with one API request, bypassing the cache."""
+        if self.local_model is not None:
+            embeddings = self._embed_locally([text])
+            return embeddings[0] if embeddings else _NO_EMBEDDING
             
+        try:
             # HuggingFace inference API expects this format
-            payload = {"inputs": text, "options": {"wait_for_model": True}}
+            payload = {"inputs": self._prepare_text(text), "options": {"wait_for_model": True}}
             
             # Make the API call
             start_time = time.time()
-            response = requests.post(self.api_url, headers=self.headers, json=payload)
+            response = self.session.post(self.api_url, content=orjson.dumps(payload))
             embedding_time = time.time() - start_time
             
             logger.debug(f"Embedding generated in {embedding_time:.2f}s")
             
             if response.status_code != 200:
                 logger.error(f"Error generating embedding: {response.text}")
-                return []
+                return _NO_EMBEDDING
                 
             # Parse the response based on response format
-            result = response.json()
-            
-            # For proper debugging
-            logger.debug(f"Embedding result type: {type(result)}")
-            if isinstance(result, dict):
-                logger.debug(f"Embedding result keys: {result.keys()}")
-            
-            # Handle different response formats
-            embedding = []
-            if isinstance(result, list) and len(result) > 0:
-                if isinstance(result[0], list):
-                    # Format: [[0.1, 0.2, ...]]
-                    embedding = result[0]
-                elif isinstance(result[0], (int, float)):
-                    # Format: [0.1, 0.2, ...]
-                    embedding = result
-            elif isinstance(result, dict):
-                if "embeddings" in result:
-                    if isinstance(result["embeddings"], list) and len(result["embeddings"]) > 0:
-                        embedding = result["embeddings"][0]
-                elif "embedding" in result:
-                    embedding = result["embedding"]
-                # Check for other potential formats
-                for key in result:
-                    if isinstance(result[key], list) and len(result[key]) > 0 and isinstance(result[key][0], (int, float)):
-                        embedding = result[key]
-                        break
-            
-            # Log dimension info for debugging
-            if embedding:
-                logger.debug(f"Generated embedding with dimension: {len(embedding)}")
-            else:
-                # If we reach here, the response format is unexpected
-                logger.error(f"Unexpected embedding response format: {result}")
-                logger.error(f"Response type: {type(result)}")
-                
-            return embedding
+            return self._parse_embedding(orjson.loads(response.content))
                 
         except Exception as e:
             logger.exception(f"Error generating embedding: {str(e)}")
-            return []
+            return _NO_EMBEDDING
             
-    def batch_generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+    def _prepare_text(self, text: str) -> str:
+        """Apply model-specific instruction if needed (for BGE models)."""
+        if "bge" in self.model_name.lower() and not text.startswith("Represent this sentence"):
+            instruction = "Represent this sentence for searching relevant passages: "
+            text = instruction + text
+        return text
+        
+    def _parse_embedding(self, result: Any) -> np.ndarray:
+        """Extract a single embedding vector from an inference API response."""
+        # For proper debugging
+        logger.debug(f"Embedding result type: {type(result)}")
+        if isinstance(result, dict):
+            logger.debug(f"Embedding result keys: {result.keys()}")
+        
+        # Handle different response formats
+        embedding = []
+        if isinstance(result, list) and len(result) > 0:
+            if isinstance(result[0], list):
+                # Format: [[0.1, 0.2, ...]]
+                embedding = result[0]
+            elif isinstance(result[0], (int, float)):
+                # Format: [0.1, 0.2, ...]
+                embedding = result
+        elif isinstance(result, dict):
+            if "embeddings" in result:
+                if isinstance(result["embeddings"], list) and len(result["embeddings"]) > 0:
+                    embedding = result["embeddings"][0]
+            elif "embedding" in result:
+                embedding = result["embedding"]
+            # Check for other potential formats
+            for key in result:
+                if isinstance(result[key], list) and len(result[key]) > 0 and isinstance(result[key][0], (int, float)):
+                    embedding = result[key]
+                    break
+        
+        # Log dimension info for debugging
+        if embedding:
+            logger.debug(f"Generated embedding with dimension: {len(embedding)}")
+            return np.asarray(embedding, dtype=np.float32)
+            
+        # If we reach here, the response format is unexpected
+        logger.error(f"Unexpected embedding response format: {result}")
+        logger.error(f"Response type: {type(result)}")
+        return _NO_EMBEDDING
+            
+    def batch_generate_embeddings(
+        self,
+        texts: List[str],
+        batch_size: int = 32,
+        concurrency: int = 8
+    ) -> List[np.ndarray]:
         """
         Generate embeddings for multiple texts in batch.
         
+        Texts are sent to the inference API as lists of up to batch_size inputs
+        per request, with up to concurrency requests in flight over the pooled
+        session; a batch whose response can't be matched up one vector per
+        input falls back to embedding its texts one at a time.
+        
         Args:
             texts: List of texts to embed
+            batch_size: Maximum number of texts per API request
+            concurrency: Maximum number of API requests in flight (at most
+                _MAX_BATCH_CONCURRENCY)
             
         Returns:
-            List of embedding vectors
+            float32 embedding vectors, in the same order as texts (empty for
+            texts that could not be embedded)
         """
         if not texts:
             return []
             
-        results = []
-        for text in texts:
-            embedding = self.generate_embedding(text)
-            results.append(embedding)
+        results, missing = self._get_cached_embeddings(texts)
+        if not missing:
+            return results
             
+        batches = self._split_batches(missing, batch_size)
+        request = lambda batch: self._request_batch([texts[i] for i in batch])
+        
+        # The local model is CPU-bound and already multithreaded, so its
+        # batches run one after another
+        if self.local_model is not None or concurrency <= 1 or len(batches) == 1:
+            responses = [request(batch) for batch in batches]
+        else:
+            in_flight = threading.BoundedSemaphore(concurrency)
+            
+            def bounded_request(batch):
+                with in_flight:
+                    return request(batch)
+                    
+            responses = list(self._batch_executor.map(bounded_request, batches))
+            
+        for batch, embeddings in zip(batches, responses):
+            self._fill_batch(results, texts, batch, embeddings)
+        self._cache_embeddings(results, texts, missing)
         return results
+        
+    async def abatch_generate_embeddings(
+        self,
+        texts: List[str],
+        batch_size: int = 32,
+        concurrency: int = 8
+    ) -> List[np.ndarray]:
+        """
+        Generate embeddings for multiple texts without blocking the event loop.
+        
+        Runs batch_generate_embeddings in a worker thread, so async callers
+        share the same pooled connections.
+        
+        Args:
+            texts: List of texts to embed
+            batch_size: Maximum number of texts per API request
+            concurrency: Maximum number of API requests in flight
+            
+        Returns:
+            float32 embedding vectors, in the same order as texts (empty for
+            texts that could not be embedded)
+        """
+        return await asyncio.to_thread(self.batch_generate_embeddings, texts, batch_size, concurrency)
+        
+    def _get_cached_embeddings(self, texts: List[str]):
+        """
+        Look up cached embeddings for a list of texts in one round trip.
+        
+        Returns:
+            (results, missing) where results holds the cached vectors in text
+            order and missing lists the positions of non-empty texts to embed
+        """
+        results = [_NO_EMBEDDING] * len(texts)
+        positions = [i for i, text in enumerate(texts) if text]
+        cached = cache.mget([self._cache_key(texts[i]) for i in positions])
+        
+        missing = []
+        for i, value in zip(positions, cached):
+            embedding = _from_cache(value)
+            if embedding is not None:
+                results[i] = embedding
+            else:
+                missing.append(i)
+        return results, missing
+        
+    def _cache_embeddings(self, results: List[np.ndarray], texts: List[str], positions: List[int]) -> None:
+        """Cache newly generated embeddings in one round trip."""
+        cache.mset({
+            self._cache_key(texts[i]): results[i].tobytes()
+            for i in positions
+            if results[i].size
+        }, ttl=EMBEDDING_CACHE_TTL)
+        
+    def _split_batches(self, positions: List[int], batch_size: int) -> List[List[int]]:
+        """Group text positions into request-sized batches."""
+        return [positions[start:start + batch_size] for start in range(0, len(positions), batch_size)]
+        
+    def _fill_batch(
+        self,
+        results: List[np.ndarray],
+        texts: List[str],
+        batch: List[int],
+        embeddings: Optional[List[np.ndarray]]
+    ) -> None:
+        """Store a batch's embeddings, embedding texts one at a time if the batch failed."""
+        if embeddings is None:
+            embeddings = [self._request_embedding(texts[i]) for i in batch]
+            
+        for i, embedding in zip(batch, embeddings):
+            results[i] = embedding
+        
+    def _batch_payload(self, texts: List[str]) -> bytes:
+        return orjson.dumps({
+            "inputs": [self._prepare_text(text) for text in texts],
+            "options": {"wait_for_model": True}
+        })
+        
+    def _parse_batch(self, response: httpx.Response, count: int) -> Optional[List[np.ndarray]]:
+        """Extract one vector per input from a batch response, or None."""
+        if response.status_code != 200:
+            logger.warning(f"Batch embedding request failed: {response.text}")
+            return None
+            
+        result = orjson.loads(response.content)
+        
+        # Expect one flat vector per input: [[0.1, ...], [0.2, ...]]
+        if (
+            isinstance(result, list)
+            and len(result) == count
+            and all(
+                isinstance(vector, list) and vector and isinstance(vector[0], (int, float))
+                for vector in result
+            )
+        ):
+            return list(np.asarray(result, dtype=np.float32))
+            
+        logger.warning("Unexpected batch embedding response format, embedding texts individually")
+        return None
+        
+    def _request_batch(self, texts: List[str]) -> Optional[List[np.ndarray]]:
+        """Embed several texts in one API request, or None if that fails."""
+        if self.local_model is not None:
+            return self._embed_locally(texts)
+            
+        try:
+            start_time = time.time()
+            response = self.session.post(self.api_url, content=self._batch_payload(texts))
+            logger.debug(f"Generated {len(texts)} embeddings in {time.time() - start_time:.2f}s")
+            return self._parse_batch(response, len(texts))
+        except Exception as e:
+            logger.exception(f"Error generating batch embeddings: {str(e)}")
+            return None
+            
+    def _embed_locally(self, texts: List[str]) -> Optional[List[np.ndarray]]:
+        """Embed several texts with the local model in one forward pass, or None if that fails."""
+        try:
+            start_time = time.time()
+            embeddings = self.local_model.embed([self._prepare_text(text) for text in texts])
+            logger.debug(f"Generated {len(texts)} local embeddings in {time.time() - start_time:.2f}s")
+            return list(embeddings)
+        except Exception as e:
+            logger.exception(f"Error generating local embeddings: {str(e)}")
+            return None
 
 # Create a global instance with default configuration
 embedding_service = EmbeddingService() 
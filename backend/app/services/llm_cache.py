@@ -0,0 +1,170 @@
+"""
+Response cache for LLM calls: exact matches on the prompt inputs first, then,
+when enabled, earlier versions of the same conversation matched by embedding
+similarity.
+"""
+import os
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+import numpy as np
+from app.services.cache import cache
+from app.services.embedding import embedding_service
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Same lifetime as the summaries cached per conversation
+LLM_CACHE_TTL = 3600
+# Off by default: the embedder only sees a text's first 512 tokens, so a
+# conversation that grew past them still matches, and gets back its old response
+SEMANTIC_CACHE_ENABLED = os.getenv("LLM_SEMANTIC_CACHE", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("LLM_SEMANTIC_CACHE_THRESHOLD", "0.9"))
+
+# Bounds on the in-process index of recent texts per conversation and prompt
+_MAX_GROUPS = 1024
+_MAX_ENTRIES_PER_GROUP = 16
+
+class LLMResponseCache:
+    """Two-tier cache for LLM responses over the shared cache backend."""
+
+    def __init__(self, ttl: int = LLM_CACHE_TTL, similarity_threshold: float = SEMANTIC_CACHE_THRESHOLD):
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        # (namespace, conversation_id, params) -> recent (key, normalized
+        # embedding) pairs; the responses themselves live in the cache backend
+        # under those keys. Scoping by conversation keeps one conversation's
+        # response from ever being served for another's text
+        self._recent: "OrderedDict[Tuple[str, str, str], Deque[Tuple[str, np.ndarray]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def make_key(self, namespace: str, params: str, text: str) -> str:
+        """
+        Build the exact-match key for a response.
+
+        Args:
+            namespace: Kind of response, e.g. "draft" or "summary"
+            params: Prompt inputs other than the conversation, which must match exactly
+            text: Conversation text sent to the model
+        """
+        digest = hashlib.blake2b(f"{params}|{text}".encode("utf-8"), digest_size=16).hexdigest()
+        return f"llm:{namespace}:{digest}"
+
+    def get(self, key: str) -> Optional[str]:
+        """Get a response by its exact-match key."""
+        return cache.get(key)
+
+    def set(self, key: str, value: str, ttl: Optional[int] = None) -> bool:
+        """Store a response under its exact-match key."""
+        return cache.set(key, value, ttl=ttl or self.ttl)
+
+    async def aget(self, key: str) -> Optional[str]:
+        """Get a response by its exact-match key without blocking the event loop."""
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, value: str, ttl: Optional[int] = None) -> bool:
+        """Store a response under its exact-match key without blocking the event loop."""
+        return await asyncio.to_thread(self.set, key, value, ttl)
+
+    async def get_similar(self, namespace: str, conversation_id: str, params: str, text: str) -> Optional[str]:
+        """
+        Find a response cached for near-identical text of the same conversation with the same params.
+
+        Args:
+            namespace: Kind of response
+            conversation_id: Conversation the text was taken from
+            params: Prompt inputs other than the conversation
+            text: Conversation text sent to the model
+
+        Returns:
+            The cached response, or None if no recent text is similar enough
+        """
+        if not SEMANTIC_CACHE_ENABLED:
+            return None
+
+        with self._lock:
+            recent = list(self._recent.get((namespace, conversation_id, params), ()))
+        if not recent:
+            return None
+
+        embedding = await self._embed(text)
+        if embedding is None:
+            return None
+
+        candidates = [(key, e) for key, e in recent if e.shape == embedding.shape]
+        if not candidates:
+            return None
+        similarities = np.stack([e for _, e in candidates]) @ embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+
+        value = await self.aget(candidates[best][0])
+        if value:
+            logger.info(f"Semantic {namespace} cache hit (similarity {similarities[best]:.3f})")
+        return value
+
+    async def add_similar(self, namespace: str, conversation_id: str, params: str, text: str, key: str) -> None:
+        """Index a cached response's conversation text for later similarity lookups."""
+        if not SEMANTIC_CACHE_ENABLED:
+            return
+
+        embedding = await self._embed(text)
+        if embedding is None:
+            return
+
+        group = (namespace, conversation_id, params)
+        with self._lock:
+            recent = self._recent.get(group)
+            if recent is None:
+                recent = self._recent[group] = deque(maxlen=_MAX_ENTRIES_PER_GROUP)
+                if len(self._recent) > _MAX_GROUPS:
+                    self._recent.popitem(last=False)
+            else:
+                self._recent.move_to_end(group)
+            recent.append((key, embedding))
+
+    async def _embed(self, text: str) -> Optional[np.ndarray]:
+        """Embed text as a unit vector, or None if no embedding is available."""
+        embedding = await asyncio.to_thread(embedding_service.generate_embedding, text)
+        norm = np.linalg.norm(embedding) if np.size(embedding) else 0.0
+        if not norm:
+            return None
+        return (np.asarray(embedding, dtype=np.float32) / norm).ravel()
+
+async def coalesce(inflight: Dict[str, asyncio.Task], key: str, factory: Callable[[], Awaitable[T]]) -> T:
+    """
+    Run factory() once for all concurrent callers with the same key.
+
+    The first caller starts the work as a task and later callers await that
+    same task until it finishes. Callers await it through a shield, so one
+    that disconnects doesn't cancel the call for the others.
+
+    Args:
+        inflight: Map of running tasks, owned by the calling service
+        key: Identifies calls that would produce the same result
+        factory: Creates the coroutine doing the work
+
+    Returns:
+        The result of the shared call
+    """
+    task = inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(factory())
+        inflight[key] = task
+        task.add_done_callback(lambda t: _finish_inflight(inflight, key, t))
+    return await asyncio.shield(task)
+
+def _finish_inflight(inflight: Dict[str, asyncio.Task], key: str, task: asyncio.Task) -> None:
+    """Drop a finished task, marking its exception retrieved if every caller left."""
+    if inflight.get(key) is task:
+        del inflight[key]
+    if not task.cancelled():
+        task.exception()
+
+# Global LLM response cache instance
+llm_cache = LLMResponseCache()
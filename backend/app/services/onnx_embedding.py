@@ -0,0 +1,105 @@
+"""
+Local embedding model served with ONNX Runtime.
+"""
+import os
+import logging
+import threading
+from typing import List
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class OnnxEmbeddingModel:
+    """BGE sentence embeddings computed in-process from an exported ONNX model."""
+
+    def __init__(self, model_dir: str, max_length: int = 512, max_batch_size: int = 32):
+        """
+        Load the model and its tokenizer.
+
+        Args:
+            model_dir: Directory written by scripts/export_onnx_embedding.py,
+                holding model_quantized.onnx (or model.onnx) and tokenizer.json
+            max_length: Maximum number of tokens per text; longer texts are truncated
+            max_batch_size: Most texts run through the model in one forward pass
+        """
+        # Only needed when local embeddings are enabled
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_path = os.path.join(model_dir, "model_quantized.onnx")
+        if not os.path.exists(model_path):
+            model_path = os.path.join(model_dir, "model.onnx")
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        pad_id = self.tokenizer.token_to_id("[PAD]") or 0
+        # Pad each batch to its longest text rather than to max_length
+        self.tokenizer.enable_padding(pad_id=pad_id, pad_token="[PAD]")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            model_path,
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.output_name = self.session.get_outputs()[0].name
+
+        # Input buffers are allocated once at their largest size and each
+        # batch is bound to a contiguous (batch, length) view of them
+        self.max_batch_size = max_batch_size
+        size = max_batch_size * max_length
+        self._input_ids = np.zeros(size, dtype=np.int64)
+        self._attention_mask = np.zeros(size, dtype=np.int64)
+        self._token_type_ids = np.zeros(size, dtype=np.int64)
+        self._io_binding = self.session.io_binding()
+        self._lock = threading.Lock()
+        logger.info(f"Loaded ONNX embedding model from {model_path}")
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed texts, up to max_batch_size of them per forward pass.
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            (len(texts), dimension) float32 array of L2-normalized embeddings
+        """
+        batches = [
+            self._embed_batch(texts[i:i + self.max_batch_size])
+            for i in range(0, len(texts), self.max_batch_size)
+        ]
+        return np.concatenate(batches) if batches else np.empty((0, 0), dtype=np.float32)
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Run one forward pass over texts padded to the longest among them."""
+        encodings = self.tokenizer.encode_batch(texts)
+        batch_size, seq_len = len(encodings), len(encodings[0].ids)
+
+        with self._lock:
+            input_ids = self._input_ids[:batch_size * seq_len].reshape(batch_size, seq_len)
+            attention_mask = self._attention_mask[:batch_size * seq_len].reshape(batch_size, seq_len)
+            for row, encoding in enumerate(encodings):
+                input_ids[row] = encoding.ids
+                attention_mask[row] = encoding.attention_mask
+
+            io_binding = self._io_binding
+            io_binding.clear_binding_inputs()
+            io_binding.clear_binding_outputs()
+            io_binding.bind_cpu_input("input_ids", input_ids)
+            io_binding.bind_cpu_input("attention_mask", attention_mask)
+            if "token_type_ids" in self.input_names:
+                token_type_ids = self._token_type_ids[:batch_size * seq_len].reshape(batch_size, seq_len)
+                io_binding.bind_cpu_input("token_type_ids", token_type_ids)
+            io_binding.bind_output(self.output_name)
+
+            self.session.run_with_iobinding(io_binding)
+            hidden_states = io_binding.copy_outputs_to_cpu()[0]
+
+        # BGE pools with the [CLS] token and normalizes, matching the
+        # vectors the inference API returns for the same model
+        embeddings = hidden_states[:, 0].astype(np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
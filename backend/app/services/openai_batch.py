@@ -0,0 +1,81 @@
+"""
+Helpers for running chat completions through the OpenAI Batch API.
+
+Batch requests are billed at half price and use a separate rate limit pool,
+at the cost of results arriving within 24 hours instead of immediately.
+"""
+import logging
+import orjson
+from typing import Dict, Optional, Tuple
+from app.services.openai_client import openai_client
+
+logger = logging.getLogger(__name__)
+
+# Batch API jobs complete within 24 hours; keep their tracking a day longer
+BATCH_TRACKING_TTL = 2 * 24 * 3600
+
+async def submit_chat_batch(requests: Dict[str, Dict], filename: str) -> str:
+    """
+    Upload chat completion requests and start a batch over them.
+
+    Args:
+        requests: Request bodies keyed by custom_id
+        filename: Name for the uploaded JSONL input file
+
+    Returns:
+        ID of the created batch
+
+    Raises:
+        OpenAIError: If the upload or batch creation fails
+    """
+    lines = [
+        orjson.dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": body
+        })
+        for custom_id, body in requests.items()
+    ]
+    input_file = await openai_client.files.create(
+        file=(filename, b"\n".join(lines)),
+        purpose="batch"
+    )
+    batch = await openai_client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    return batch.id
+
+async def fetch_chat_batch(batch_id: str) -> Tuple[str, Optional[Dict[str, str]]]:
+    """
+    Check a batch and download its completions once it has finished.
+
+    Args:
+        batch_id: ID returned by submit_chat_batch
+
+    Returns:
+        The batch status, and the stripped completion text keyed by custom_id
+        when the batch has completed (None otherwise). Jobs that failed are
+        logged and left out.
+
+    Raises:
+        OpenAIError: If the status or results can't be retrieved
+    """
+    batch = await openai_client.batches.retrieve(batch_id)
+    if batch.status != "completed" or not batch.output_file_id:
+        return batch.status, None
+    output = await openai_client.files.content(batch.output_file_id)
+
+    results = {}
+    for line in output.content.splitlines():
+        if not line.strip():
+            continue
+        record = orjson.loads(line)
+        response = record.get("response") or {}
+        if response.get("status_code") != 200:
+            logger.warning(f"Batch job {record.get('custom_id')} failed: {record.get('error')}")
+            continue
+        results[record["custom_id"]] = (response["body"]["choices"][0]["message"]["content"] or "").strip()
+    return batch.status, results
@@ -0,0 +1,41 @@
+"""
+Process-wide OpenAI client shared by every service that calls the API.
+"""
+import os
+import logging
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+openai_api_key = os.getenv("OPENAI_API_KEY")
+# Pooled HTTP/2 transport so bursts of summaries, drafts and refinements
+# reuse warm TLS connections (limits passed to the client itself are
+# ignored once a transport is given)
+_openai_transport = httpx.AsyncHTTPTransport(
+    http2=True,
+    retries=2,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+)
+_openai_timeout = httpx.Timeout(30.0, connect=5.0)
+# The SDK retries 408/409/429/5xx and connection errors with exponential
+# backoff and jitter, honouring Retry-After
+openai_client = AsyncOpenAI(
+    api_key=openai_api_key,
+    timeout=_openai_timeout,
+    max_retries=int(os.getenv("OPENAI_MAX_RETRIES", "3")),
+    http_client=httpx.AsyncClient(transport=_openai_transport, timeout=_openai_timeout)
+)
+
+async def warm_openai_client() -> None:
+    """Open a pooled connection to OpenAI ahead of the first real request."""
+    try:
+        await openai_client.models.list()
+    except Exception as e:
+        logger.warning(f"Could not warm OpenAI connection pool: {e}")
+
+async def close_openai_client() -> None:
+    """Close the pooled connections on shutdown."""
+    await openai_client.close()
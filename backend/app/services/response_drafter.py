@@ -1,28 +1,54 @@
 """
 Response drafter service for generating draft responses to conversations using OpenAI.
 """
-import os
-import re
+import asyncio
 import time
 import logging
-from collections import Counter
 from dotenv import load_dotenv
-from typing import Optional
-from openai import OpenAIError, OpenAI
+from typing import AsyncIterator, Dict, Optional
+from openai import OpenAIError
+from app.services.tokenizer import tokenizer
+from app.services.speaker_stats import speaker_stats
+from app.services.openai_client import openai_client
+from app.services.llm_cache import llm_cache, coalesce
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
-openai_api_key = os.getenv("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=openai_api_key)
+
+# Conversation context sent with each draft, in model tokens
+_CONVERSATION_TOKEN_LIMIT = 1500
+
+# Invariant parts of the drafting prompt, built once
+_DRAFT_SYSTEM_BASE = "You are an expert at paraphrasing messages while maintaining a specific user's writing style.\n"
+_DRAFT_AS_USER_INSTRUCTIONS = (
+    "Your task is to rephrase the user's input message AS IF IT WAS WRITTEN BY {as_user}.\n"
+    "Carefully analyze {as_user}'s writing style from the conversation history and mimic it exactly.\n"
+    "While maintaining {as_user}'s style, ensure you:\n"
+    "1. Keep the same meaning and intent as the original message\n"
+    "2. Use {as_user}'s typical phrases, emojis, and writing patterns\n"
+    "3. Match {as_user}'s level of formality and tone\n"
+    "4. Preserve any specific details or requests from the original message\n"
+    "5. Not add any new information or responses\n"
+)
+_DRAFT_INSTRUCTIONS = (
+    "Your task is to rephrase the user's input message in a natural, conversational tone.\n"
+    "While maintaining the original meaning, ensure you:\n"
+    "1. Keep the same meaning and intent\n"
+    "2. Expand the message make it polite. immprove grammar and logic, make tone conversational and natural\n"
+    "3. Preserve any specific details or requests\n"
+    "4. Not add any new information or responses\n"
+)
 
 class ResponseDrafterService:
     """Service for generating draft responses to conversations."""
 
     def __init__(self, cache_ttl=3600):
         self.cache_ttl = cache_ttl
+        # Drafts being generated, so identical concurrent requests share one call
+        self._inflight: Dict[str, asyncio.Task] = {}
 
-    def draft_response(
+    async def draft_response(
         self,
         conversation_text: str,
         as_user: Optional[str] = None,
@@ -33,60 +59,101 @@ class ResponseDrafterService:
         if not user_input:
             return ""
 
-        # Get speaker stats for context
-        speakers = re.findall(r"^(.+?):", conversation_text, re.MULTILINE)
-        speaker_counts = Counter(speakers)
-        num_users = len(speaker_counts)
-        top_users = ", ".join([f"{user} ({count} msgs)" for user, count in speaker_counts.most_common(5)])
-
-        system_prompt = (
-            f"You are an expert at paraphrasing messages while maintaining a specific user's writing style.\n"
-            f"There are {num_users} participants in the conversation, mainly {top_users}.\n"
+        key = llm_cache.make_key("draft", f"{as_user}|{user_input}|{prefer_something}", conversation_text)
+        return await coalesce(
+            self._inflight,
+            key,
+            lambda: self._draft_response(conversation_text, as_user, user_input, prefer_something)
         )
 
-        if as_user:
-            system_prompt += (
-                f"Your task is to rephrase the user's input message AS IF IT WAS WRITTEN BY {as_user}.\n"
-                f"Carefully analyze {as_user}'s writing style from the conversation history and mimic it exactly.\n"
-                f"While maintaining {as_user}'s style, ensure you:\n"
-                "1. Keep the same meaning and intent as the original message\n"
-                "2. Use {as_user}'s typical phrases, emojis, and writing patterns\n"
-                "3. Match {as_user}'s level of formality and tone\n"
-                "4. Preserve any specific details or requests from the original message\n"
-                "5. Not add any new information or responses\n"
-                "\n"
-                "The message to rephrase in {as_user}'s style is:\n"
-                f"{user_input}"
-            )
-        else:
-            system_prompt += (
-                "Your task is to rephrase the user's input message in a natural, conversational tone.\n"
-                "While maintaining the original meaning, ensure you:\n"
-                "1. Keep the same meaning and intent\n"
-                "2. Expand the message make it polite. immprove grammar and logic, make tone conversational and natural\n"
-                "3. Preserve any specific details or requests\n"
-                "4. Not add any new information or responses\n"
-                "\n"
-                "The message to rephrase is:\n"
-                f"{user_input}"
-            )
+    async def _draft_response(
+        self,
+        conversation_text: str,
+        as_user: Optional[str],
+        user_input: str,
+        prefer_something: bool
+    ) -> str:
+        """Generate a draft by collecting the streamed response."""
+        start_time = time.time()
+        parts = []
+        async for delta in self.stream_draft_response(conversation_text, as_user, user_input, prefer_something):
+            parts.append(delta)
+        logger.info(f"OpenAI call took {time.time() - start_time:.2f}s")
+        return "".join(parts).strip()
+
+    async def stream_draft_response(
+        self,
+        conversation_text: str,
+        as_user: Optional[str] = None,
+        user_input: Optional[str] = None,
+        prefer_something: bool = False
+    ) -> AsyncIterator[str]:
+        """Yield a draft response piece by piece as the model generates it."""
+        if not user_input:
+            return
+
+        # Keep the most recent part of the conversation, which is what a reply
+        # has to fit; speaker stats only cover the part the model sees
+        conversation_text = tokenizer.truncate_from_end(conversation_text, _CONVERSATION_TOKEN_LIMIT)
+
+        # The same request against the same conversation text reuses the
+        # earlier draft instead of calling the model again. Drafts are made
+        # from raw text with no conversation id, so there is no scope for a
+        # similarity lookup that couldn't serve another user's draft
+        params = f"{as_user}|{user_input}|{prefer_something}"
+        cache_key = llm_cache.make_key("draft", params, conversation_text)
+        cached_draft = await llm_cache.aget(cache_key)
+        if cached_draft:
+            yield cached_draft
+            return
+
+        system_prompt = self._build_system_prompt(conversation_text, as_user, user_input)
 
+        parts = []
         try:
-            start_time = time.time()
-            response = openai_client.chat.completions.create(
+            stream = await openai_client.chat.completions.create(
                 model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": conversation_text[:6000]}
+                    {"role": "user", "content": conversation_text}
                 ],
-                temperature=0.7
+                temperature=0.7,
+                stream=True
             )
-            logger.info(f"OpenAI call took {time.time() - start_time:.2f}s")
-            return response.choices[0].message.content.strip()
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
         except OpenAIError as e:
             logger.exception("OpenAI error drafting response")
             raise RuntimeError(f"Response drafting failed: {e}")
 
+        draft = "".join(parts).strip()
+        if draft:
+            await llm_cache.aset(cache_key, draft, ttl=self.cache_ttl)
+
+    def _build_system_prompt(self, conversation_text: str, as_user: Optional[str], user_input: str) -> str:
+        # Get speaker stats for context
+        num_users, top_users = speaker_stats(conversation_text)
+        stats = f"There are {num_users} participants in the conversation, mainly {top_users}.\n\n"
+
+        # Constant instructions go first so requests share a prompt prefix
+        if as_user:
+            parts = [
+                _DRAFT_SYSTEM_BASE,
+                _DRAFT_AS_USER_INSTRUCTIONS.format(as_user=as_user),
+                stats,
+                f"The message to rephrase in {as_user}'s style is:\n{user_input}"
+            ]
+        else:
+            parts = [
+                _DRAFT_SYSTEM_BASE,
+                _DRAFT_INSTRUCTIONS,
+                stats,
+                f"The message to rephrase is:\n{user_input}"
+            ]
+        return "".join(parts)
+
 
 # Global response drafter instance
 response_drafter_service = ResponseDrafterService() 
\ No newline at end of file
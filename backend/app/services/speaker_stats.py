@@ -0,0 +1,21 @@
+"""
+Speaker statistics for "author: content" conversation transcripts, shared by
+the prompts that describe who is talking.
+"""
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import Tuple
+
+# A speaker name is everything before the first colon of a line; the bounded
+# character class can't backtrack across long lines of message text
+_SPEAKER_RE = re.compile(r"^([^:\n]{1,64}):", re.MULTILINE)
+
+@lru_cache(maxsize=256)
+def speaker_stats(conversation_text: str) -> Tuple[int, str]:
+    """Participant count and top speakers, cached since the same text is often summarized or drafted against repeatedly."""
+    speaker_counts = Counter(_SPEAKER_RE.findall(conversation_text))
+    # Small channels have at most five speakers; sorting them all skips the heap
+    top = speaker_counts.most_common() if len(speaker_counts) <= 5 else speaker_counts.most_common(5)
+    top_users = ", ".join(f"{user} ({count} msgs)" for user, count in top)
+    return len(speaker_counts), top_users
@@ -1,84 +1,86 @@
 """
 Summarizer service for generating conversation summaries using OpenAI GPT-3.5.
 """
-import os
-import re
 import time
+import asyncio
 import logging
-from collections import Counter
 from dotenv import load_dotenv
-from typing import Optional
-from openai import OpenAIError, OpenAI
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from openai import OpenAIError
 from sqlalchemy.orm import Session
 from app.models.summary import Summary
 from app.repositories.message_repository import message_repository
 from app.models.chunk import MessageChunk
 from app.services.context import context_service
 from app.services.tokenizer import tokenizer
+from app.services.speaker_stats import speaker_stats
+from app.services.openai_client import openai_client
+from app.services.openai_batch import BATCH_TRACKING_TTL, submit_chat_batch, fetch_chat_batch
 from app.services.cache import cache
+from app.services.llm_cache import llm_cache, coalesce
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
-openai_api_key = os.getenv("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=openai_api_key)
+
+# Conversation context sent with each summary, in model tokens; leaves
+# headroom in gpt-4o-mini's window for the system prompt and the summary
+_CONVERSATION_TOKEN_LIMIT = 3500
+
+# Invariant parts of the summarization prompt, built once
+_SUMMARY_SYSTEM_PROMPT = (
+    "You are a professional conversation summarizer.\n"
+    "Summarize the conversation:\n"
+    "- Mention key points made.\n"
+    "- Highlight important statements.\n"
+    "Be detailed and faithful to the tone.\n\n"
+)
+_FOCUSED_SUMMARY_SYSTEM_PROMPT = (
+    "You are a professional conversation summarizer.\n"
+    "Summarize the conversation:\n"
+    "- Mention key points made related to the focus topic.\n"
+    "- Highlight important statements relevant to the query.\n"
+    "Be detailed and faithful to the tone.\n\n"
+)
 
 class SummarizerService:
     """Service for generating conversation summaries."""
 
     def __init__(self, cache_ttl=3600):
         self.cache_ttl = cache_ttl
+        # Summaries being generated, so concurrent misses share one call
+        self._inflight: Dict[str, asyncio.Task] = {}
 
 
-    def summarize_conversation(
+    async def summarize_conversation(
         self,
         conversation_text: str,
-        query: Optional[str] = None
+        query: Optional[str] = None,
+        conversation_id: Optional[str] = None,
+        use_cache: bool = True
     ) -> str:
         start_time = time.time()
 
-        # Speaker stats
-        speakers = re.findall(r"^(.+?):", conversation_text, re.MULTILINE)
-        speaker_counts = Counter(speakers)
-        num_users = len(speaker_counts)
-        top_users = ", ".join([f"{user} ({count} msgs)" for user, count in speaker_counts.most_common(5)])
-
-        # System prompt
-        system_prompt = (
-            f"You are a professional conversation summarizer.\n"
-            f"There are {num_users} participants, mainly {top_users}.\n"
-        )
-        if query:
-            system_prompt += (
-                f"Focus your summary on content related to: '{query}'.\n"
-                f"Summarize the conversation:\n"
-                f"- Mention key points made related to the focus topic.\n"
-                f"- Highlight important statements relevant to the query.\n"
-                f"Be detailed and faithful to the tone.\n\n"
-            )
-        else:
-            system_prompt += (
-                f"Summarize the conversation:\n"
-                f"- Mention key points made.\n"
-                f"- Highlight important statements.\n"
-                f"Be detailed and faithful to the tone.\n\n"
-            )
+        # Semantic context lists the most relevant chunks first, so truncation
+        # keeps the head; speaker stats only cover the part the model sees
+        conversation_text = tokenizer.truncate_to_token_count(conversation_text, _CONVERSATION_TOKEN_LIMIT)
 
-        try:
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": conversation_text[:6000]}
-            ]
+        # Identical text summarized for the same query reuses the earlier
+        # summary, unless the caller asked for a fresh one
+        params = query or ""
+        cache_key = llm_cache.make_key("summary", params, conversation_text)
+        if use_cache:
+            cached_summary = await llm_cache.aget(cache_key) or await self._get_similar_summary(conversation_id, params, conversation_text)
+            if cached_summary:
+                return cached_summary
 
-            response = openai_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                temperature=0.3
+        try:
+            response = await openai_client.chat.completions.create(
+                **self._summary_request(conversation_text, query)
             )
 
             summary = response.choices[0].message.content.strip()
             logger.info(f"OpenAI call took {time.time() - start_time:.2f}s")
-            return summary
 
         except OpenAIError as e:
             logger.exception("OpenAI API error")
@@ -87,9 +89,161 @@ class SummarizerService:
             logger.exception("Unexpected error during summarization")
             raise RuntimeError(f"Summarization failed due to exception: {str(e)}")
 
+        if summary:
+            await llm_cache.aset(cache_key, summary, ttl=self.cache_ttl)
+            if conversation_id:
+                await llm_cache.add_similar("summary", conversation_id, params, conversation_text, cache_key)
+        return summary
+
+    async def _get_similar_summary(self, conversation_id: Optional[str], params: str, conversation_text: str) -> Optional[str]:
+        """A summary of near-identical text from the same conversation, when it is known."""
+        if not conversation_id:
+            return None
+        return await llm_cache.get_similar("summary", conversation_id, params, conversation_text)
+
+    async def stream_summarize_conversation(
+        self,
+        conversation_text: str,
+        query: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """Yield a summary piece by piece as the model generates it."""
+        conversation_text = tokenizer.truncate_to_token_count(conversation_text, _CONVERSATION_TOKEN_LIMIT)
+
+        params = query or ""
+        cache_key = llm_cache.make_key("summary", params, conversation_text)
+        cached_summary = await llm_cache.aget(cache_key)
+        if cached_summary:
+            yield cached_summary
+            return
+
+        parts = []
+        try:
+            stream = await openai_client.chat.completions.create(
+                **self._summary_request(conversation_text, query),
+                stream=True
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        except OpenAIError as e:
+            logger.exception("OpenAI error streaming summary")
+            raise RuntimeError(f"Summarization failed due to OpenAI error: {str(e)}")
+
+        # Stored like a non-streamed summary, so either path can reuse it
+        summary = "".join(parts).strip()
+        if summary:
+            await llm_cache.aset(cache_key, summary, ttl=self.cache_ttl)
+
+    def _summary_request(self, conversation_text: str, query: Optional[str]) -> Dict:
+        """Chat completion parameters for summarizing already truncated text."""
+        # Speaker stats
+        num_users, top_users = speaker_stats(conversation_text)
+
+        # Constant instructions go first so requests share a prompt prefix
+        parts = [
+            _FOCUSED_SUMMARY_SYSTEM_PROMPT if query else _SUMMARY_SYSTEM_PROMPT,
+            f"There are {num_users} participants, mainly {top_users}.\n"
+        ]
+        if query:
+            parts.append(f"Focus your summary on content related to: '{query}'.\n")
+        system_prompt = "".join(parts)
+
+        return {
+            "model": "gpt-4o-mini",
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": conversation_text}
+            ],
+            "temperature": 0.3
+        }
+
+    async def submit_batch(self, db: Session, conversation_ids: List[str]) -> Tuple[Optional[str], List[str]]:
+        """
+        Queue full summaries for many conversations on the OpenAI Batch API.
+        
+        Meant for bulk refreshes that can wait up to 24 hours in exchange for
+        half-price requests outside the realtime rate limit. Each summary is
+        made from the conversation's most recent context, with no query, so
+        it can be stored as the conversation's latest full summary.
+        
+        Args:
+            db: Database session
+            conversation_ids: Conversations to summarize
+            
+        Returns:
+            ID of the created batch (None if nothing was submitted), and the
+            conversations skipped for having no context
+        """
+        requests = {}
+        skipped = []
+        for conversation_id in dict.fromkeys(conversation_ids):
+            context = await asyncio.to_thread(context_service.get_context, db, conversation_id, None)
+            if not context:
+                skipped.append(conversation_id)
+                continue
+            conversation_text = tokenizer.truncate_to_token_count(context, _CONVERSATION_TOKEN_LIMIT)
+            requests[conversation_id] = self._summary_request(conversation_text, None)
+
+        if not requests:
+            return None, skipped
+
+        try:
+            batch_id = await submit_chat_batch(requests, "summary_batch.jsonl")
+        except OpenAIError as e:
+            logger.exception("OpenAI error submitting summary batch")
+            raise RuntimeError(f"Summary batch submission failed: {e}")
+
+        # Marks the batch's results as not yet stored
+        if not await asyncio.to_thread(cache.set, f"summary:batch:{batch_id}", True, BATCH_TRACKING_TTL):
+            logger.error(f"Could not track summary batch {batch_id}; its summaries won't be stored when polled")
+        logger.info(f"Submitted summary batch {batch_id} with {len(requests)} conversations")
+        return batch_id, skipped
+
+    async def poll_batch(self, db: Session, batch_id: str) -> Tuple[str, Optional[Dict[str, str]]]:
+        """
+        Check a summary batch and store its summaries once complete.
+        
+        Args:
+            db: Database session
+            batch_id: ID returned by submit_batch
+            
+        Returns:
+            The batch status, and summaries keyed by conversation ID when the
+            batch has completed (None otherwise)
+        """
+        try:
+            status, summaries = await fetch_chat_batch(batch_id)
+        except OpenAIError as e:
+            logger.exception("OpenAI error fetching summary batch")
+            raise RuntimeError(f"Summary batch fetch failed: {e}")
+        if summaries is None:
+            return status, None
 
+        # Store the results as each conversation's latest full summary. Taking
+        # the marker is atomic, so only one of several concurrent polls stores them
+        if not await asyncio.to_thread(cache.pop, f"summary:batch:{batch_id}"):
+            logger.warning(
+                f"Not storing summary batch {batch_id}: it was already stored, its "
+                "tracking expired, or the cache is unreachable"
+            )
+            return status, summaries
 
-    def get_or_create_summary(
+        for conversation_id, summary_text in summaries.items():
+            if summary_text:
+                await asyncio.to_thread(
+                    self._save_summary,
+                    db,
+                    conversation_id,
+                    None,
+                    f"conversation:{conversation_id}:summary",
+                    summary_text,
+                    True
+                )
+
+        return status, summaries
+
+    async def aget_or_create_summary(
         self,
         db: Session,
         conversation_id: str,
@@ -97,11 +251,65 @@ class SummarizerService:
         use_cache: bool = True,
         force_refresh: bool = False
     ) -> str:
+        """
+        Return a cached or stored summary, or generate one from the conversation context.
+        
+        Database and cache work runs in worker threads so the event loop is
+        only held for the OpenAI call itself.
+        """
         start_time = time.time()
         cache_key = f"conversation:{conversation_id}:summary"
         if query:
             cache_key += f":{query}"
 
+        existing_summary = await asyncio.to_thread(
+            self._get_existing_summary, db, conversation_id, query, cache_key, use_cache, force_refresh
+        )
+        if existing_summary:
+            return existing_summary
+
+        # A refresh doesn't share a call that may still return a cached summary
+        summary_text = await coalesce(
+            self._inflight,
+            f"{cache_key}:refresh" if force_refresh else cache_key,
+            lambda: self._generate_summary(db, conversation_id, query, cache_key, use_cache, force_refresh)
+        )
+
+        logger.info(f"Summary generation took {time.time() - start_time:.2f}s total")
+        return summary_text
+
+    async def _generate_summary(
+        self,
+        db: Session,
+        conversation_id: str,
+        query: Optional[str],
+        cache_key: str,
+        use_cache: bool,
+        force_refresh: bool = False
+    ) -> str:
+        """Summarize the conversation context and store the result, calling the model again on a refresh."""
+        context, query = await asyncio.to_thread(self._get_summary_context, db, conversation_id, query)
+        if not context:
+            return "No conversation data available to summarize."
+
+        summary_text = await self.summarize_conversation(
+            context, query, conversation_id, use_cache=not force_refresh
+        )
+        await asyncio.to_thread(
+            self._save_summary, db, conversation_id, query, cache_key, summary_text, use_cache
+        )
+        return summary_text
+
+    def _get_existing_summary(
+        self,
+        db: Session,
+        conversation_id: str,
+        query: Optional[str],
+        cache_key: str,
+        use_cache: bool,
+        force_refresh: bool
+    ) -> Optional[str]:
+        """Look up a summary in the cache, then the latest full summary in the database."""
         if use_cache and not force_refresh:
             cached_summary = cache.get(cache_key)
             if cached_summary:
@@ -109,18 +317,28 @@ class SummarizerService:
                 return cached_summary
 
         if not query and not force_refresh:
+            # Only the content is needed, so skip loading the whole row
             existing_summary = (
-                db.query(Summary)
+                db.query(Summary.content)
                 .filter(Summary.conversation_id == conversation_id)
                 .order_by(Summary.timestamp.desc())
-                .first()
+                .limit(1)
+                .scalar()
             )
             if existing_summary:
                 logger.info(f"Using existing summary for conversation {conversation_id}")
                 if use_cache:
-                    cache.set(cache_key, existing_summary.content, ttl=self.cache_ttl)
-                return existing_summary.content
+                    cache.set(cache_key, existing_summary, ttl=self.cache_ttl)
+                return existing_summary
+        return None
 
+    def _get_summary_context(
+        self,
+        db: Session,
+        conversation_id: str,
+        query: Optional[str]
+    ) -> Tuple[str, Optional[str]]:
+        """Retrieve the context to summarize, along with the query it was retrieved for."""
         # 💡 Add: auto semantic query based on recent messages
         if not query:
             recent_messages = message_repository.get_messages(db, conversation_id, skip=0, limit=3)
@@ -133,26 +351,32 @@ class SummarizerService:
             context = context_service.get_context(db, conversation_id, query_text=None)
             if not context:
                 logger.warning(f"No context available for conversation {conversation_id}")
-                return "No conversation data available to summarize."
-
-        summary_text = self.summarize_conversation(context, query)
-        token_count = tokenizer.count_tokens(summary_text)
+        return context, query
 
+    def _save_summary(
+        self,
+        db: Session,
+        conversation_id: str,
+        query: Optional[str],
+        cache_key: str,
+        summary_text: str,
+        use_cache: bool
+    ) -> None:
+        """Store a full summary in the database and cache the summary text."""
         if not query:
-            chunks = (
-                db.query(MessageChunk)
+            chunk_ids = [
+                chunk_id for chunk_id, in db.query(MessageChunk.id)
                 .filter(MessageChunk.conversation_id == conversation_id)
                 .order_by(MessageChunk.end_time.desc())
                 .limit(context_service.top_k)
-                .all()
-            )
-            chunk_ids = [chunk.id for chunk in chunks]
+            ]
             new_summary = Summary(
                 conversation_id=conversation_id,
                 content=summary_text,
                 chunk_ids=chunk_ids,
                 is_full_summary=True,
-                token_count=token_count
+                # Only persisted summaries need an exact count
+                token_count=tokenizer.count_tokens(summary_text)
             )
             db.add(new_summary)
             db.commit()
@@ -160,9 +384,6 @@ class SummarizerService:
         if use_cache:
             cache.set(cache_key, summary_text, ttl=self.cache_ttl)
 
-        logger.info(f"Summary generation took {time.time() - start_time:.2f}s total")
-        return summary_text
-
 
 # Global summarizer instance
 summarizer_service = SummarizerService()
\ No newline at end of file
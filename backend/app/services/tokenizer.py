@@ -1,8 +1,22 @@
 """
 Tokenization service for estimating token counts in text.
 """
+import os
 import tiktoken
 
+# tiktoken downloads the BPE ranks into the system temp dir by default, which
+# is wiped with every fresh container; keep them somewhere persistent so new
+# workers load the file instead of fetching it again. The default sits under
+# the backend directory wherever the process starts; tiktoken creates it on
+# first download
+if "TIKTOKEN_CACHE_DIR" not in os.environ:
+    os.environ["TIKTOKEN_CACHE_DIR"] = os.path.abspath(
+        os.path.join(os.path.dirname(__file__), "..", "..", "data", "tiktoken_cache")
+    )
+
+# Batch encoding runs in tiktoken's Rust threads, outside the GIL
+_BATCH_THREADS = os.cpu_count() or 1
+
 # Default tokenizer model - matches the one used by our LLM
 DEFAULT_TOKENIZER = "cl100k_base"  # For recent OpenAI models
 
@@ -15,20 +29,48 @@ class TokenizerService:
         """Count the number of tokens in the provided text."""
         if not text:
             return 0
-        tokens = self.tokenizer.encode(text)
+        # Message text is never meant to contain special tokens, so skip the
+        # special-token scan (which also raises on text like "<|endoftext|>")
+        tokens = self.tokenizer.encode_ordinary(text)
         return len(tokens)
     
+    def count_tokens_batch(self, texts):
+        """Count the tokens in each of several texts, encoding them in parallel."""
+        if not texts:
+            return []
+        return [len(tokens) for tokens in self.tokenizer.encode_ordinary_batch(texts, num_threads=_BATCH_THREADS)]
+    
     def truncate_to_token_count(self, text, max_tokens):
         """Truncate text to fit within max_tokens."""
         if not text:
             return ""
+        if self._fits_without_encoding(text, max_tokens):
+            return text
         
-        tokens = self.tokenizer.encode(text)
+        tokens = self.tokenizer.encode_ordinary(text)
         if len(tokens) <= max_tokens:
             return text
             
         truncated_tokens = tokens[:max_tokens]
         return self.tokenizer.decode(truncated_tokens)
+    
+    def truncate_from_end(self, text, max_tokens):
+        """Keep only the last max_tokens tokens of text, dropping the oldest content."""
+        if not text or max_tokens <= 0:
+            return ""
+        if self._fits_without_encoding(text, max_tokens):
+            return text
+        
+        tokens = self.tokenizer.encode_ordinary(text)
+        if len(tokens) <= max_tokens:
+            return text
+            
+        return self.tokenizer.decode(tokens[-max_tokens:])
+    
+    @staticmethod
+    def _fits_without_encoding(text, max_tokens):
+        """Whether text is certainly within max_tokens: every token covers at least one byte."""
+        return len(text) <= max_tokens and (text.isascii() or len(text.encode("utf-8")) <= max_tokens)
 
 # Create a global instance for convenience
 tokenizer = TokenizerService() 
\ No newline at end of file
@@ -5,13 +5,38 @@ import numpy as np
 import faiss
 import uuid
 import os
+import atexit
+import threading
 import pickle
-from typing import List, Dict, Any, Optional, Tuple
+import tempfile
+from typing import List, Dict, Any, Optional, Tuple, Union
 import logging
 from app.services.embedding import embedding_service
 
 logger = logging.getLogger(__name__)
 
+# Conversations with this many vectors are moved from an exact flat index to
+# an HNSW graph, which searches in roughly log time at high recall
+HNSW_MIN_VECTORS = 1000
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+
+# Store large indexes' vectors as 8-bit scalars, a quarter of the bytes to
+# scan per search, at a small cost in recall. The quantizer is trained on the
+# vectors present when an index is rebuilt, so small indexes stay exact
+VECTOR_QUANTIZE = os.getenv("VECTOR_QUANTIZE", "0") == "1"
+
+# Single-vector adds are written to disk every this many adds (and at exit)
+# instead of rewriting the whole index each time
+SAVE_EVERY_ADDS = 32
+
+# Most recently written indexes loaded into memory at startup
+PRELOAD_INDEXES = int(os.getenv("VECTOR_PRELOAD_COUNT", "16"))
+
+def _is_empty(embedding) -> bool:
+    return embedding is None or np.size(embedding) == 0
+
 class VectorStore:
     """FAISS-based vector store for semantic search."""
     
@@ -25,47 +50,127 @@ class VectorStore:
         """
         self.dimension = dimension
         self.index_dir = index_dir
-        self.indices = {}  # Map of conversation_id -> FAISS index
-        self.id_maps = {}  # Map of conversation_id -> {id_in_index: chunk_id}
+        # Map of conversation_id -> FAISS index whose ids are the chunk ids
+        self.indices = {}
+        self.unsaved_adds = {}  # Map of conversation_id -> adds not yet on disk
+        # Held while an index is loaded or created, so a startup preload and a
+        # request loading the same conversation can't each install their own
+        # copy and drop vectors added to the other
+        self._load_lock = threading.RLock()
         
         # Create index directory if it doesn't exist
         os.makedirs(index_dir, exist_ok=True)
+        atexit.register(self.flush_all)
         
-    def _get_or_create_index(self, conversation_id: str) -> Tuple[faiss.Index, Dict[int, str]]:
+    def _get_or_create_index(self, conversation_id: str) -> faiss.IndexIDMap2:
         """Get an existing index or create a new one for the conversation."""
-        if conversation_id in self.indices:
-            return self.indices[conversation_id], self.id_maps[conversation_id]
+        index = self.indices.get(conversation_id)
+        if index is not None:
+            return index
+            
+        with self._load_lock:
+            # Another thread may have loaded it while this one waited
+            index = self.indices.get(conversation_id)
+            if index is None:
+                index = self._load_or_create_index(conversation_id)
+            return index
             
+    def _load_or_create_index(self, conversation_id: str) -> faiss.IndexIDMap2:
+        """Load a conversation's index from disk, or create an empty one; called under the load lock."""
         # Check if index exists on disk
         index_path = os.path.join(self.index_dir, f"{conversation_id}_index.faiss")
-        map_path = os.path.join(self.index_dir, f"{conversation_id}_map.pkl")
         
-        if os.path.exists(index_path) and os.path.exists(map_path):
+        if os.path.exists(index_path):
             try:
                 logger.info(f"Loading existing index for conversation {conversation_id}")
                 index = faiss.read_index(index_path)
-                with open(map_path, "rb") as f:
-                    id_map = pickle.load(f)
+                if not isinstance(index, faiss.IndexIDMap2):
+                    index = self._convert_legacy_index(conversation_id, index)
                     
-                self.indices[conversation_id] = index
-                self.id_maps[conversation_id] = id_map
-                return index, id_map
+                if index is not None:
+                    self.indices[conversation_id] = index
+                    return index
             except Exception as e:
                 logger.exception(f"Error loading index: {str(e)}")
                 
         # Create a new index
         logger.info(f"Creating new index for conversation {conversation_id}")
-        index = faiss.IndexFlatL2(self.dimension)
-        id_map = {}
+        index = self._build_index(np.empty((0, self.dimension), dtype=np.float32), [])
         
         self.indices[conversation_id] = index
-        self.id_maps[conversation_id] = id_map
         
-        return index, id_map
+        return index
+        
+    def warm_up(self, limit: int = PRELOAD_INDEXES) -> int:
+        """
+        Load the most recently written indexes, those of the most active
+        conversations, ahead of their first search.
+        
+        Args:
+            limit: Maximum number of indexes to load
+            
+        Returns:
+            Number of indexes loaded
+        """
+        suffix = "_index.faiss"
+        try:
+            entries = [entry for entry in os.scandir(self.index_dir) if entry.name.endswith(suffix)]
+        except OSError as e:
+            logger.warning(f"Could not list indexes to preload: {str(e)}")
+            return 0
+            
+        entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in entries[:limit]:
+            self._get_or_create_index(entry.name[:-len(suffix)])
+        logger.info(f"Preloaded {min(len(entries), limit)} vector indexes")
+        return min(len(entries), limit)
+        
+    def _convert_legacy_index(self, conversation_id: str, index: faiss.Index) -> Optional[faiss.IndexIDMap2]:
+        """
+        Rebuild an index saved with a pickled position -> chunk_id map so its ids are the chunk ids.
+        
+        Returns:
+            The converted index, or None if the map is missing
+        """
+        map_path = os.path.join(self.index_dir, f"{conversation_id}_map.pkl")
+        if not os.path.exists(map_path):
+            logger.warning(f"Index for conversation {conversation_id} has no id map, starting a new one")
+            return None
+            
+        with open(map_path, "rb") as f:
+            id_map = pickle.load(f)
+        positions = [position for position in sorted(id_map) if position < index.ntotal]
+        vectors = index.reconstruct_n(0, index.ntotal)[positions]
+        converted = self._build_index(vectors, [id_map[position] for position in positions])
+        
+        self.indices[conversation_id] = converted
+        self._save_index(conversation_id)
+        os.remove(map_path)
+        logger.info(f"Converted legacy index for conversation {conversation_id}")
+        return converted
+        
+    def _build_index(self, vectors: np.ndarray, chunk_ids) -> faiss.IndexIDMap2:
+        """Create an index holding vectors under their chunk ids, as HNSW once there are enough."""
+        if len(chunk_ids) >= HNSW_MIN_VECTORS and VECTOR_QUANTIZE:
+            base = faiss.IndexHNSWSQ(self.dimension, faiss.ScalarQuantizer.QT_8bit, HNSW_M)
+            base.train(vectors)
+        elif len(chunk_ids) >= HNSW_MIN_VECTORS:
+            base = faiss.IndexHNSWFlat(self.dimension, HNSW_M)
+        else:
+            base = faiss.IndexFlatL2(self.dimension)
+            
+        if isinstance(base, faiss.IndexHNSW):
+            base.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            base.hnsw.efSearch = HNSW_EF_SEARCH
+            
+        index = faiss.IndexIDMap2(base)
+        if len(chunk_ids):
+            index.add_with_ids(vectors, np.asarray(chunk_ids, dtype=np.int64))
+        return index
         
     def add_embedding(
         self, 
-        embedding: List[float], 
+        embedding: np.ndarray, 
         conversation_id: str, 
         chunk_id: int
     ) -> str:
@@ -80,50 +185,137 @@ class VectorStore:
         Returns:
             ID of the embedding in the store
         """
-        if not embedding:
+        if _is_empty(embedding):
             return None
         
         try:
-            # Check if embedding is a float instead of a list/array
-            if isinstance(embedding, float):
-                logger.warning(f"Received a float instead of a list for embedding, creating a default vector")
-                embedding = [embedding] + [0.0] * (self.dimension - 1)
-                
-            # Ensure embedding is the right dimensionality
-            if len(embedding) != self.dimension:
-                logger.warning(f"Embedding dimension mismatch. Expected {self.dimension}, got {len(embedding)}")
-                # Pad or truncate as needed
-                if len(embedding) < self.dimension:
-                    # Pad with zeros
-                    embedding = embedding + [0.0] * (self.dimension - len(embedding))
-                else:
-                    # Truncate
-                    embedding = embedding[:self.dimension]
-            
-            # Convert to properly shaped numpy array (2D)
-            vector = np.array([embedding], dtype=np.float32)
+            # Reshape to the (1, dimension) batch FAISS expects
+            vector = self._fit_dimension(embedding).reshape(1, -1)
             
             # Get or create the index
-            index, id_map = self._get_or_create_index(conversation_id)
+            index = self._get_or_create_index(conversation_id)
             
-            # Add to index
-            idx = index.ntotal
-            index.add(vector)
+            # Add to index under the chunk's id
+            index.add_with_ids(vector, np.array([chunk_id], dtype=np.int64))
             
-            # Update id map
-            id_map[idx] = chunk_id
+            self._upgrade_large_index(conversation_id, index)
             
-            # Save updated index
-            self._save_index(conversation_id)
+            # Save updated index once enough adds have accumulated
+            unsaved = self.unsaved_adds.get(conversation_id, 0) + 1
+            if unsaved >= SAVE_EVERY_ADDS:
+                self._save_index(conversation_id)
+            else:
+                self.unsaved_adds[conversation_id] = unsaved
             
-            return str(idx)
+            return str(chunk_id)
         except Exception as e:
             logger.exception(f"Error adding embedding: {str(e)}")
             return None
         
+    def add_embeddings(
+        self, 
+        embeddings: Union[List[np.ndarray], np.ndarray], 
+        conversation_id: str, 
+        chunk_ids: List[int]
+    ) -> List[Optional[str]]:
+        """
+        Add several embedding vectors to the store with a single index update.
+        
+        Args:
+            embeddings: The embedding vectors, or an (N, dimension) array of them
+            conversation_id: ID of the conversation
+            chunk_ids: IDs of the chunks in the database, parallel to embeddings
+            
+        Returns:
+            ID of each embedding in the store, or None where the embedding was empty
+        """
+        ids = [None] * len(embeddings)
+        if isinstance(embeddings, np.ndarray) and embeddings.ndim == 2 and embeddings.shape[1] == self.dimension:
+            # Already a matrix of full vectors: hand it to FAISS without
+            # fitting each row (no copy when it is contiguous float32)
+            positions = range(len(embeddings))
+        else:
+            positions = [i for i, embedding in enumerate(embeddings) if not _is_empty(embedding)]
+        if not positions:
+            return ids
+            
+        try:
+            if isinstance(positions, range):
+                vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+            else:
+                vectors = np.vstack([self._fit_dimension(embeddings[i]) for i in positions])
+            
+            # Get or create the index
+            index = self._get_or_create_index(conversation_id)
+            
+            # Add all vectors at once, each under its chunk's id
+            index.add_with_ids(vectors, np.array([chunk_ids[i] for i in positions], dtype=np.int64))
+            
+            for i in positions:
+                ids[i] = str(chunk_ids[i])
+                
+            self._upgrade_large_index(conversation_id, index)
+            
+            # Save updated index once for the whole batch
+            self._save_index(conversation_id)
+            
+            return ids
+        except Exception as e:
+            logger.exception(f"Error adding embeddings: {str(e)}")
+            return [None] * len(embeddings)
+        
+    def _upgrade_large_index(self, conversation_id: str, index: faiss.IndexIDMap2) -> faiss.IndexIDMap2:
+        """
+        Rebuild a flat index that has grown past HNSW_MIN_VECTORS as an HNSW index.
+        
+        Small conversations stay on the flat index, whose exact scan is faster there.
+        
+        Returns:
+            The index now in use for the conversation
+        """
+        if not self._is_flat(index) or index.ntotal < HNSW_MIN_VECTORS:
+            return index
+            
+        logger.info(f"Rebuilding index for conversation {conversation_id} as HNSW ({index.ntotal} vectors)")
+        hnsw = self._build_index(*self._contents(index))
+        
+        self.indices[conversation_id] = hnsw
+        return hnsw
+        
+    @staticmethod
+    def _is_flat(index: faiss.IndexIDMap2) -> bool:
+        return isinstance(faiss.downcast_index(index.index), faiss.IndexFlat)
+        
+    @staticmethod
+    def _contents(index: faiss.IndexIDMap2) -> Tuple[np.ndarray, np.ndarray]:
+        """The vectors in an index and their chunk ids, in insertion order."""
+        return index.index.reconstruct_n(0, index.ntotal), faiss.vector_to_array(index.id_map)
+        
+    def _fit_dimension(self, embedding) -> np.ndarray:
+        """Pad or truncate an embedding to the store's dimensionality as float32."""
+        # Check if embedding is a float instead of a list/array
+        if isinstance(embedding, float):
+            logger.warning(f"Received a float instead of a list for embedding, creating a default vector")
+            embedding = [embedding]
+            
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+            
+        # Ensure embedding is the right dimensionality
+        if len(embedding) != self.dimension:
+            logger.warning(f"Embedding dimension mismatch. Expected {self.dimension}, got {len(embedding)}")
+            # Pad or truncate as needed
+            if len(embedding) < self.dimension:
+                # Pad with zeros
+                embedding = np.pad(embedding, (0, self.dimension - len(embedding)))
+            else:
+                # Truncate
+                embedding = embedding[:self.dimension]
+                
+        return embedding
+        
     def search(
         self, 
-        query_embedding: List[float], 
+        query_embedding: np.ndarray, 
         conversation_id: str, 
         top_k: int = 5
     ) -> List[Tuple[int, float]]:
@@ -131,49 +323,80 @@ class VectorStore:
         Search for similar vectors.
         
         Args:
-            query_embedding: The query embedding vector
+            query_embedding: The query embedding vector; a float32 array is
+                searched as-is, anything else is converted first
             conversation_id: ID of the conversation to search in
             top_k: Number of results to return
             
         Returns:
             List of (chunk_id, similarity score) tuples
         """
-        if not query_embedding or not conversation_id:
+        if _is_empty(query_embedding) or not conversation_id:
             return []
             
-        # Convert to numpy array
-        query_vector = np.array([query_embedding]).astype('float32')
+        # Search it as a batch of one; this is a view, not a copy, when the
+        # embedding is already a float32 array
+        query_vector = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+        return self.search_batch(query_vector, conversation_id, top_k)[0]
+        
+    def search_batch(
+        self,
+        query_embeddings: np.ndarray,
+        conversation_id: str,
+        top_k: int = 5
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        Search for vectors similar to each of several queries in one FAISS call.
+        
+        Args:
+            query_embeddings: (n, dimension) matrix of query embeddings; a
+                C-contiguous float32 array is searched as-is
+            conversation_id: ID of the conversation to search in
+            top_k: Number of results to return per query
+            
+        Returns:
+            One list of (chunk_id, similarity score) tuples per query
+        """
+        query_vectors = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+        if query_vectors.ndim != 2 or not query_vectors.size or not conversation_id:
+            return [[] for _ in range(len(query_vectors))]
+        if query_vectors.shape[1] != self.dimension:
+            # FAISS would reject the queries outright, so fit them like stored vectors
+            logger.warning(f"Embedding dimension mismatch. Expected {self.dimension}, got {query_vectors.shape[1]}")
+            fitted = np.zeros((len(query_vectors), self.dimension), dtype=np.float32)
+            width = min(self.dimension, query_vectors.shape[1])
+            fitted[:, :width] = query_vectors[:, :width]
+            query_vectors = fitted
         
         # Get the index
         try:
-            index, id_map = self._get_or_create_index(conversation_id)
+            index = self._get_or_create_index(conversation_id)
         except Exception as e:
             logger.exception(f"Error accessing index: {str(e)}")
-            return []
+            return [[] for _ in range(len(query_vectors))]
             
         # Search
         if index.ntotal == 0:
             logger.warning(f"Empty index for conversation {conversation_id}")
-            return []
+            return [[] for _ in range(len(query_vectors))]
             
         # Limit top_k to the number of vectors in the index
         top_k = min(top_k, index.ntotal)
         
-        # Perform search
-        distances, indices = index.search(query_vector, top_k)
+        # Perform search; the ids it returns are chunk ids
+        distances, chunk_ids = index.search(query_vectors, top_k)
         
-        # Map index IDs to chunk IDs
-        results = []
-        for i, idx in enumerate(indices[0]):
-            chunk_id = id_map.get(int(idx))
-            if chunk_id is not None:
-                # Convert distance to similarity score (1 - normalized distance)
-                # FAISS L2 distance: lower is better
-                # We want similarity: higher is better
-                similarity = 1.0 - (distances[0][i] / (distances[0][-1] + 1e-5))
-                results.append((chunk_id, similarity))
-            
-        return results
+        # Map squared L2 distance (lower is better) to a similarity in (0, 1]
+        # (higher is better) that depends only on the pair itself, unlike
+        # scaling by the worst result, which always scored it 0
+        similarities = 1.0 / (1.0 + distances)
+        
+        # An HNSW search can come back short, padding with -1 ids
+        found = chunk_ids >= 0
+        return [
+            list(zip(row_ids[row_found].tolist(), row_similarities[row_found].tolist()))
+            for row_ids, row_similarities, row_found in zip(chunk_ids, similarities, found)
+        ]
         
     def search_by_text(
         self, 
@@ -198,19 +421,71 @@ class VectorStore:
         # Search with the generated embedding
         return self.search(query_embedding, conversation_id, top_k)
         
+    def flush(self, conversation_id: str) -> None:
+        """Write a conversation's index to disk if it has unsaved adds."""
+        if conversation_id in self.unsaved_adds:
+            self._save_index(conversation_id)
+            
+    def flush_all(self) -> None:
+        """Write every index with unsaved adds to disk."""
+        if not os.path.isdir(self.index_dir):
+            # The store's directory was removed along with everything in it
+            return
+        for conversation_id in list(self.unsaved_adds):
+            try:
+                self.flush(conversation_id)
+            except Exception as e:
+                logger.exception(f"Error saving index for conversation {conversation_id}: {str(e)}")
+        
+    def clear(self) -> None:
+        """Drop every loaded index and its unsaved adds; files on disk are left alone."""
+        with self._load_lock:
+            self.indices.clear()
+            self.unsaved_adds.clear()
+        
     def _save_index(self, conversation_id: str) -> None:
         """Save the index and id map to disk"""
-        index, id_map = self._get_or_create_index(conversation_id)
+        self.unsaved_adds.pop(conversation_id, None)
+        # Only indexes already in memory are ever saved
+        index = self.indices[conversation_id]
         
         index_path = os.path.join(self.index_dir, f"{conversation_id}_index.faiss")
-        map_path = os.path.join(self.index_dir, f"{conversation_id}_map.pkl")
         
-        # Save the index
-        faiss.write_index(index, index_path)
+        # Save the index, chunk ids included; writing a temp file and renaming
+        # it means a crash mid-write never leaves a truncated index behind. The
+        # temp name is unique, so concurrent saves never write the same file
+        fd, tmp_path = tempfile.mkstemp(dir=self.index_dir, prefix=f"{conversation_id}_index.", suffix=".tmp")
+        os.close(fd)
+        try:
+            faiss.write_index(index, tmp_path)
+            os.replace(tmp_path, index_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+            
+    def discard_chunks(self, conversation_id: str, chunk_ids: List[int]) -> None:
+        """
+        Remove the given chunks' vectors from a conversation's index.
         
-        # Save the id map
-        with open(map_path, 'wb') as f:
-            pickle.dump(id_map, f)
+        Args:
+            conversation_id: ID of the conversation
+            chunk_ids: IDs of chunks that no longer exist
+        """
+        chunk_ids = np.fromiter(set(chunk_ids), dtype=np.int64)
+        if not chunk_ids.size:
+            return
+        index = self._get_or_create_index(conversation_id)
+        if self._is_flat(index):
+            removed = index.remove_ids(chunk_ids)
+        else:
+            # HNSW graphs can't drop vectors, so rebuild without them
+            vectors, stored_ids = self._contents(index)
+            keep = ~np.isin(stored_ids, chunk_ids)
+            removed = len(stored_ids) - int(keep.sum())
+            if removed:
+                self.indices[conversation_id] = self._build_index(vectors[keep], stored_ids[keep])
+        if removed:
+            self._save_index(conversation_id)
             
     def delete_conversation_embeddings(self, conversation_id: str) -> bool:
         """
@@ -224,26 +499,18 @@ class VectorStore:
         """
         try:
             index_path = os.path.join(self.index_dir, f"{conversation_id}_index.faiss")
-            map_path = os.path.join(self.index_dir, f"{conversation_id}_map.pkl")
             
             # Check if files exist
             if os.path.exists(index_path):
                 os.remove(index_path)
                 logger.info(f"Deleted FAISS index for conversation {conversation_id}")
                 
-            if os.path.exists(map_path):
-                os.remove(map_path)
-                logger.info(f"Deleted ID map for conversation {conversation_id}")
-                
             # Also remove from cache if present
+            self.unsaved_adds.pop(conversation_id, None)
             if conversation_id in self.indices:
                 del self.indices[conversation_id]
                 logger.info(f"Removed conversation {conversation_id} from index cache")
                 
-            if conversation_id in self.id_maps:
-                del self.id_maps[conversation_id]
-                logger.info(f"Removed conversation {conversation_id} from id_maps")
-                
             return True
         except Exception as e:
             logger.exception(f"Error deleting conversation embeddings: {str(e)}")
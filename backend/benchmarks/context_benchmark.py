@@ -8,7 +8,7 @@ import time
 import logging
 import statistics
 import uuid
-import random
+import numpy as np
 from datetime import datetime, timedelta
 
 # Add the parent directory to sys.path
@@ -18,6 +18,7 @@ from app.database import get_db, init_db
 from app.repositories.message_repository import message_repository
 from app.services.context import context_service
 from app.services.cache import cache
+from app.services.embedding import embedding_service
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -29,54 +30,60 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-def generate_random_message():
-    """Generate a random message."""
-    authors = ["User1", "User2", "User3", "User4", "User5"]
-    content_templates = [
-        "I think we should {action} the {thing}.",
-        "Has anyone seen the {thing}?",
-        "Let's meet at {time} to discuss the {thing}.",
-        "I disagree with {name}, because {reason}.",
-        "I agree with {name}, the {thing} is important.",
-        "What do you think about {thing}?",
-        "I'm not sure about {thing}, maybe we should {action} it.",
-        "Can someone help me with {thing}?",
-        "I've been working on {thing} all day.",
-        "Did you hear about {name}'s {thing}? It's amazing!"
+AUTHORS = ["User1", "User2", "User3", "User4", "User5"]
+CONTENT_TEMPLATES = [
+    "I think we should {action} the {thing}.",
+    "Has anyone seen the {thing}?",
+    "Let's meet at {time} to discuss the {thing}.",
+    "I disagree with {name}, because {reason}.",
+    "I agree with {name}, the {thing} is important.",
+    "What do you think about {thing}?",
+    "I'm not sure about {thing}, maybe we should {action} it.",
+    "Can someone help me with {thing}?",
+    "I've been working on {thing} all day.",
+    "Did you hear about {name}'s {thing}? It's amazing!"
+]
+ACTIONS = ["review", "update", "delete", "check", "finalize", "discuss"]
+THINGS = ["project", "report", "presentation", "budget", "proposal", "meeting", "email", "code", "design", "plan"]
+TIMES = ["2pm", "tomorrow", "next week", "Friday", "Monday morning", "after lunch"]
+REASONS = ["it's not feasible", "we don't have time", "it's too expensive", "it won't work", "we need more data"]
+
+def generate_random_messages(count, seed=None):
+    """Generate random messages in timestamp order, reproducibly for a given seed."""
+    rng = np.random.default_rng(seed)
+    
+    # Sample every field for all messages at once
+    templates = rng.choice(CONTENT_TEMPLATES, count)
+    actions = rng.choice(ACTIONS, count)
+    things = rng.choice(THINGS, count)
+    times = rng.choice(TIMES, count)
+    names = rng.choice(AUTHORS, count)
+    reasons = rng.choice(REASONS, count)
+    authors = rng.choice(AUTHORS, count)
+    # Oldest first, so the messages come out sorted by timestamp
+    minutes_ago = np.sort(rng.integers(0, 1001, count))[::-1]
+    
+    now = datetime.utcnow()
+    return [
+        {
+            "author": str(author),
+            "content": str(template).format(action=action, thing=thing, time=time, name=name, reason=reason),
+            "timestamp": now - timedelta(minutes=int(minutes))
+        }
+        for template, action, thing, time, name, reason, author, minutes
+        in zip(templates, actions, things, times, names, reasons, authors, minutes_ago)
     ]
-    
-    actions = ["review", "update", "delete", "check", "finalize", "discuss"]
-    things = ["project", "report", "presentation", "budget", "proposal", "meeting", "email", "code", "design", "plan"]
-    times = ["2pm", "tomorrow", "next week", "Friday", "Monday morning", "after lunch"]
-    reasons = ["it's not feasible", "we don't have time", "it's too expensive", "it won't work", "we need more data"]
-    
-    template = random.choice(content_templates)
-    content = template.format(
-        action=random.choice(actions),
-        thing=random.choice(things),
-        time=random.choice(times),
-        name=random.choice(authors),
-        reason=random.choice(reasons)
-    )
-    
-    return {
-        "author": random.choice(authors),
-        "content": content,
-        "timestamp": datetime.utcnow() - timedelta(minutes=random.randint(0, 1000))
-    }
 
-def create_test_conversation(db, message_count=200):
+def create_test_conversation(db, message_count=200, seed=None):
     """Create a test conversation with random messages."""
     conversation_id = str(uuid.uuid4())
     
-    # Generate messages
-    messages = [generate_random_message() for _ in range(message_count)]
-    
-    # Sort by timestamp
-    messages.sort(key=lambda x: x["timestamp"])
+    # Generate messages, already sorted by timestamp
+    messages = generate_random_messages(message_count, seed)
     
     # Create messages in the database
     created_messages = message_repository.create_messages(db, conversation_id, messages)
+    message_repository.process_conversation_chunks(db, conversation_id)
     
     logger.info(f"Created test conversation {conversation_id} with {len(created_messages)} messages")
     
@@ -87,6 +94,9 @@ def run_context_benchmark(db, conversation_id, iterations=10):
     # Ensure cache is empty
     cache.invalidate_conversation(conversation_id)
     
+    # Open the embedding connection first so the timings measure steady state
+    embedding_service.warm_up()
+    
     # Test un-cached retrieval
     uncached_times = []
     for i in range(iterations):
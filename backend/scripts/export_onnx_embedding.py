@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Export the embedding model to ONNX with INT8 dynamic quantization.
+
+Requires optimum[onnxruntime] and transformers, which the server itself
+doesn't need:
+
+    pip install "optimum[onnxruntime]" transformers
+    python scripts/export_onnx_embedding.py
+"""
+import sys
+import os
+import logging
+import tempfile
+import traceback
+
+# Add the parent directory to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.embedding import DEFAULT_EMBEDDING_MODEL, LOCAL_EMBED_MODEL_DIR
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+
+def main():
+    """Export, quantize and save the model next to its tokenizer."""
+    try:
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        from transformers import AutoTokenizer
+
+        model_name = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_EMBEDDING_MODEL
+        output_dir = sys.argv[2] if len(sys.argv) > 2 else LOCAL_EMBED_MODEL_DIR
+        os.makedirs(output_dir, exist_ok=True)
+
+        logging.info(f"Exporting {model_name} to ONNX...")
+        with tempfile.TemporaryDirectory() as export_dir:
+            model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+            model.save_pretrained(export_dir)
+
+            # Dynamic quantization needs no calibration data; the VNNI config
+            # targets int8 dot-product instructions on recent x86 CPUs
+            logging.info("Quantizing weights to INT8...")
+            quantizer = ORTQuantizer.from_pretrained(export_dir)
+            config = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            quantizer.quantize(save_dir=output_dir, quantization_config=config)
+
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(output_dir)
+        logging.info(f"Saved quantized model and tokenizer to {output_dir}")
+    except Exception as e:
+        logging.error(f"Error exporting embedding model: {str(e)}")
+        logging.error("Full traceback:")
+        traceback.print_exc()
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Shared fixtures for the backend tests.
+"""
+import pytest
+import sys
+import os
+import uuid
+from datetime import datetime
+from functools import lru_cache
+
+# Make the app package importable from every test module; pytest loads this
+# before collecting them
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from app.models.message import Message
+from app.services.embedding import embedding_service
+from app.services.vector_store import VectorStore
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "integration: tests that call the embedding model; deselect with -m 'not integration'"
+    )
+
+def pytest_collection_modifyitems(config, items):
+    # Under pytest-xdist with --dist loadgroup, keep the integration tests on
+    # one worker so only it warms up the embedding model; the rest share
+    # nothing but per-worker temp dirs and spread across workers freely
+    if not config.pluginmanager.hasplugin("xdist"):
+        return
+    for item in items:
+        if item.get_closest_marker("integration"):
+            item.add_marker(pytest.mark.xdist_group("integration"))
+
+# One timestamp for all test messages that don't care about ordering
+_NOW = datetime.utcnow()
+
+def _make_message(i, author, content, conversation_id="test-conversation", timestamp=None):
+    return Message(
+        id=i,
+        conversation_id=conversation_id,
+        author=author,
+        content=content,
+        timestamp=timestamp or _NOW
+    )
+
+@pytest.fixture(scope="module")
+def msg_factory():
+    """Build a Message from its index, author and content (plus optional conversation_id and timestamp)."""
+    return _make_message
+
+@pytest.fixture(scope="session")
+def shared_vs(tmp_path_factory):
+    """One vector store for the whole session, writing to a temporary directory."""
+    return VectorStore(index_dir=str(tmp_path_factory.mktemp("vector_indices")))
+
+@pytest.fixture(scope="session")
+def warm_embedder():
+    """The embedding service, with its connection or local model already warmed up."""
+    if not embedding_service.warm_up():
+        pytest.skip("Embedding model is unavailable")
+    return embedding_service
+
+@lru_cache(maxsize=128)
+def _cached_embedding(text):
+    embedding = embedding_service.generate_embedding(text)
+    # Callers share the cached array, so keep them from changing it
+    embedding.flags.writeable = False
+    return embedding
+
+@pytest.fixture(scope="session")
+def cached_embed(warm_embedder):
+    """Embed a text, reusing the float32 vector for texts already embedded this session."""
+    return _cached_embedding
+
+@pytest.fixture
+def fresh_vs(shared_vs):
+    """The shared vector store, emptied again after the test."""
+    yield shared_vs
+    shared_vs.clear()
+    # The directory belongs to shared_vs alone, temp files included
+    for path in os.scandir(shared_vs.index_dir):
+        os.remove(path.path)
+
+@pytest.fixture
+def conversation_id():
+    """A fresh conversation id."""
+    return str(uuid.uuid4())
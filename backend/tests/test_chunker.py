@@ -2,15 +2,9 @@
 Unit tests for the chunking service.
 """
 import pytest
-import sys
-import os
 from datetime import datetime
 
-# Add the parent directory to sys.path
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-
 from app.services.chunker import ChunkerService, ChunkerConfig
-from app.models.message import Message
 
 def test_chunk_conversation_empty():
     """Test chunking an empty conversation."""
@@ -18,17 +12,11 @@ def test_chunk_conversation_empty():
     chunks = chunker.chunk_conversation([], "test-conversation")
     assert len(chunks) == 0
 
-def test_chunk_conversation_single_message():
+def test_chunk_conversation_single_message(msg_factory):
     """Test chunking a conversation with a single message."""
     chunker = ChunkerService()
     
-    message = Message(
-        id=1,
-        conversation_id="test-conversation",
-        author="User1",
-        content="This is a test message",
-        timestamp=datetime.utcnow()
-    )
+    message = msg_factory(1, "User1", "This is a test message")
     
     chunks = chunker.chunk_conversation([message], "test-conversation")
     
@@ -39,18 +27,12 @@ def test_chunk_conversation_single_message():
     assert "User1: This is a test message" in chunks[0].content
     assert chunks[0].authors == ["User1"]
 
-def test_chunk_conversation_multiple_messages():
+def test_chunk_conversation_multiple_messages(msg_factory):
     """Test chunking a conversation with multiple messages."""
     chunker = ChunkerService()
     
     messages = [
-        Message(
-            id=i,
-            conversation_id="test-conversation",
-            author=f"User{i % 3 + 1}",
-            content=f"This is test message {i}",
-            timestamp=datetime.utcnow()
-        )
+        msg_factory(i, f"User{i % 3 + 1}", f"This is test message {i}")
         for i in range(10)
     ]
     
@@ -61,83 +43,71 @@ def test_chunk_conversation_multiple_messages():
     assert chunks[0].chunk_index == 0
     assert chunks[0].message_count == 10
     
-    # Check that all messages are included
-    for i in range(10):
-        assert f"User{i % 3 + 1}: This is test message {i}" in chunks[0].content
+    # Check that all messages are included, in order, as one string compare
+    expected_lines = [f"User{i % 3 + 1}: This is test message {i}" for i in range(10)]
+    assert chunks[0].content == "\n\n".join(expected_lines)
     
     # Check that all authors are included
     assert set(chunks[0].authors) == {"User1", "User2", "User3"}
 
-def test_chunk_conversation_respects_max_tokens():
-    """Test that chunking respects the maximum token limit."""
-    # Create a chunker with a very small token limit
-    config = ChunkerConfig(max_chunk_tokens=10, max_chunk_messages=100)
-    chunker = ChunkerService(config)
-    
-    # Create messages with known token counts
-    messages = [
-        Message(
-            id=i,
-            conversation_id="test-conversation",
-            author="User1",
-            content="A B C D E",  # Each token is a letter plus space
-            timestamp=datetime.utcnow()
-        )
-        for i in range(5)
-    ]
-    
-    chunks = chunker.chunk_conversation(messages, "test-conversation")
-    
-    # Should create multiple chunks due to token limit
+# Checks assert themselves, so a failure shows the counts and contents compared
+def _splits_into_chunks(chunks):
+    assert len(chunks) > 1
+
+def _respects_message_limit(chunks):
     assert len(chunks) > 1
+    # Each chunk should have at most 3 messages (except maybe the last one)
+    counts = [chunk.message_count for chunk in chunks[:-1]]
+    assert all(count <= 3 for count in counts), counts
+
+def _overlaps(chunks):
+    assert len(chunks) > 1
+    # Last message in first chunk is also the first in the second chunk
+    assert "Message 2" in chunks[0].content
+    assert "Message 2" in chunks[1].content
 
-def test_chunk_conversation_respects_max_messages():
-    """Test that chunking respects the maximum message limit."""
-    # Create a chunker with a small message limit
-    config = ChunkerConfig(max_chunk_tokens=1000, max_chunk_messages=3)
+@pytest.mark.parametrize(
+    "config,content,message_count,check",
+    [
+        # Each token is a letter plus space, so a very small token limit splits them
+        (ChunkerConfig(max_chunk_tokens=10, max_chunk_messages=100), "A B C D E", 5, _splits_into_chunks),
+        # More messages than the message limit
+        (ChunkerConfig(max_chunk_tokens=1000, max_chunk_messages=3), "Message {i}", 10, _respects_message_limit),
+        # Message limit with overlap
+        (ChunkerConfig(max_chunk_tokens=1000, max_chunk_messages=3, overlap_messages=1), "Message {i}", 5, _overlaps),
+    ],
+    ids=["max_tokens", "max_messages", "overlap"]
+)
+def test_chunk_conversation_limits(msg_factory, config, content, message_count, check):
+    """Test that chunking respects the token and message limits and overlaps chunks."""
     chunker = ChunkerService(config)
     
-    # Create more messages than the limit
     messages = [
-        Message(
-            id=i,
-            conversation_id="test-conversation",
-            author="User1",
-            content=f"Message {i}",
-            timestamp=datetime.utcnow()
-        )
-        for i in range(10)
+        msg_factory(i, "User1", content.format(i=i))
+        for i in range(message_count)
     ]
     
     chunks = chunker.chunk_conversation(messages, "test-conversation")
     
-    # Should create multiple chunks due to message limit
-    assert len(chunks) > 1
-    
-    # Each chunk should have at most 3 messages (except maybe the last one)
-    for i, chunk in enumerate(chunks[:-1]):
-        assert chunk.message_count <= 3
+    check(chunks)
 
-def test_chunk_conversation_with_overlap():
-    """Test that chunking includes overlapping messages."""
-    # Create a chunker with message limit and overlap
+def test_chunk_conversation_resume_matches_full_run(msg_factory):
+    """Test that resuming from the last chunk reproduces a full run."""
     config = ChunkerConfig(max_chunk_tokens=1000, max_chunk_messages=3, overlap_messages=1)
     chunker = ChunkerService(config)
     
-    # Create sequential messages
     messages = [
-        Message(
-            id=i,
-            conversation_id="test-conversation",
-            author="User1",
-            content=f"Message {i}",
-            timestamp=datetime.utcnow()
-        )
-        for i in range(5)
+        msg_factory(i, f"User{i % 2 + 1}", f"Message {i}", timestamp=datetime(2025, 1, 1, 12, i))
+        for i in range(8)
     ]
     
-    chunks = chunker.chunk_conversation(messages, "test-conversation")
+    full = chunker.chunk_conversation(messages, "test-conversation")
     
-    # Should have overlap between chunks
-    assert "Message 2" in chunks[0].content  # Last message in first chunk
-    assert "Message 2" in chunks[1].content  # First message in second chunk (overlap) 
\ No newline at end of file
+    # With 3 messages per chunk and 1 carried over, chunk 2 starts at message 4
+    resumed = chunker.chunk_conversation(
+        messages[4:], "test-conversation", start_index=2, carried_messages=1
+    )
+    
+    assert [(c.chunk_index, c.content, c.message_count) for c in resumed] == [
+        (c.chunk_index, c.content, c.message_count) for c in full[2:]
+    ]
@@ -2,32 +2,22 @@
 Integration tests for the backend services.
 """
 import pytest
-import sys
-import os
-import uuid
-from datetime import datetime
+import numpy as np
 
-# Add the parent directory to sys.path
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-
-from app.models.message import Message
 from app.services.chunker import ChunkerService
-from app.services.embedding import embedding_service
-from app.services.vector_store import vector_store
 
-def test_chunking_and_embedding_pipeline():
+@pytest.mark.integration
+def test_chunking_and_embedding_pipeline(fresh_vs, warm_embedder, conversation_id, msg_factory):
     """Test the entire chunking and embedding pipeline."""
-    # Create a test conversation
-    conversation_id = str(uuid.uuid4())
+    vector_store = fresh_vs
     
-    # Create test messages
+    # Create test messages, all sharing one timestamp
     messages = [
-        Message(
-            id=i,
-            conversation_id=conversation_id,
-            author="User1" if i % 2 == 0 else "User2",
-            content=f"This is test message number {i} with some content to embed.",
-            timestamp=datetime.now()
+        msg_factory(
+            i,
+            "User1" if i % 2 == 0 else "User2",
+            f"This is test message number {i} with some content to embed.",
+            conversation_id=conversation_id
         )
         for i in range(5)
     ]
@@ -39,23 +29,20 @@ def test_chunking_and_embedding_pipeline():
     # Verify chunks were created
     assert len(chunks) > 0
     
-    # Embed each chunk and add to vector store
-    chunk_ids = []
-    for i, chunk in enumerate(chunks):
-        # Generate embedding
-        embedding = embedding_service.generate_embedding(chunk.content)
-        
-        # Verify embedding has the correct dimension
-        assert len(embedding) == vector_store.dimension
-        
-        # Add to vector store
-        idx = vector_store.add_embedding(embedding, conversation_id, chunk.id or i)
-        
-        # Verify it was added successfully
-        assert idx is not None
-        
-        # Store chunk id for later search
-        chunk_ids.append(chunk.id or i)
+    # Embed all chunks in one batched call
+    embeddings = warm_embedder.batch_generate_embeddings([chunk.content for chunk in chunks])
+    
+    # Verify each embedding has the correct dimension
+    assert all(len(embedding) == vector_store.dimension for embedding in embeddings)
+    
+    # Add them to the vector store as one matrix in a single index update
+    # Unsaved chunks have no database id yet, so key them by their position
+    chunk_ids = [chunk.chunk_index for chunk in chunks]
+    idx_list = vector_store.add_embeddings(np.stack(embeddings), conversation_id, chunk_ids)
+    
+    # Verify they were all added successfully
+    assert len(idx_list) == len(chunks)
+    assert all(idx is not None for idx in idx_list)
     
     # Test search functionality
     test_query = "test message with content"
@@ -64,5 +51,8 @@ def test_chunking_and_embedding_pipeline():
     # Verify we get results
     assert len(results) > 0
     
-    # Cleanup
-    vector_store.delete_conversation_embeddings(conversation_id) 
\ No newline at end of file
+    # Several queries go through one batched FAISS search
+    queries = np.stack(warm_embedder.batch_generate_embeddings(["test", "message", "content"]))
+    batch_results = vector_store.search_batch(queries, conversation_id, top_k=3)
+    assert len(batch_results) == 3
+    assert all(len(query_results) == min(3, len(chunks)) for query_results in batch_results)
@@ -0,0 +1,47 @@
+"""
+Tests for the app-wide middleware.
+"""
+import asyncio
+import os
+
+# The OpenAI client is created at import time and only needs a key, not a
+# reachable API, for these tests
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from app.api import _sse_stream
+from app.main import EventStreamSafeGZipMiddleware
+
+def test_gzip_does_not_buffer_sse_events():
+    """Test that each SSE event reaches the client before the stream ends."""
+    async def run():
+        first_event_sent = asyncio.Event()
+        messages = []
+
+        async def deltas():
+            yield "first"
+            # Only continue once the first event is out; if the middleware
+            # buffered it, the stream would never finish
+            await first_event_sent.wait()
+            yield "second"
+
+        async def receive():
+            await asyncio.Event().wait()
+
+        async def send(message):
+            messages.append(message)
+            if b"first" in message.get("body", b""):
+                first_event_sent.set()
+
+        middleware = EventStreamSafeGZipMiddleware(_sse_stream(deltas()), minimum_size=512)
+        scope = {"type": "http", "headers": [(b"accept-encoding", b"gzip")]}
+        await asyncio.wait_for(middleware(scope, receive, send), timeout=5)
+        return messages
+
+    messages = asyncio.run(run())
+
+    headers = dict(messages[0]["headers"])
+    assert headers[b"content-type"].startswith(b"text/event-stream")
+    assert b"content-encoding" not in headers
+    body = b"".join(message.get("body", b"") for message in messages[1:])
+    assert body.startswith(b'data: {"delta":"first"}\n\n')
+    assert body.endswith(b"event: done\ndata: {}\n\n")
@@ -0,0 +1,57 @@
+"""
+Tests for the local INT8 ONNX embedding model.
+
+These export the embedding model, so they only run when optimum[onnxruntime]
+is installed and the model can be downloaded.
+"""
+import pytest
+import numpy as np
+
+from app.services.embedding import DEFAULT_EMBEDDING_MODEL
+
+# Lowest cosine similarity accepted between INT8 and FP32 embeddings of the
+# same text; dynamic quantization should cost far less fidelity than this
+INT8_MIN_COSINE = 0.995
+
+_TEXTS = [
+    "This is a test sentence for embedding",
+    "User1: Are we still meeting at three tomorrow?\n\nUser2: Yes, same room as last week.",
+]
+
+@pytest.fixture(scope="module")
+def onnx_models(tmp_path_factory):
+    """FP32 and INT8 OnnxEmbeddingModels exported once for the module."""
+    pytest.importorskip("optimum.onnxruntime")
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+    from app.services.onnx_embedding import OnnxEmbeddingModel
+
+    fp32_dir = tmp_path_factory.mktemp("fp32")
+    int8_dir = tmp_path_factory.mktemp("int8")
+    try:
+        ORTModelForFeatureExtraction.from_pretrained(DEFAULT_EMBEDDING_MODEL, export=True).save_pretrained(fp32_dir)
+        tokenizer = AutoTokenizer.from_pretrained(DEFAULT_EMBEDDING_MODEL)
+    except OSError as e:
+        pytest.skip(f"Could not download {DEFAULT_EMBEDDING_MODEL}: {e}")
+
+    # Same quantization as scripts/export_onnx_embedding.py
+    config = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+    ORTQuantizer.from_pretrained(fp32_dir).quantize(save_dir=int8_dir, quantization_config=config)
+    tokenizer.save_pretrained(fp32_dir)
+    tokenizer.save_pretrained(int8_dir)
+
+    return OnnxEmbeddingModel(str(fp32_dir)), OnnxEmbeddingModel(str(int8_dir))
+
+@pytest.mark.integration
+def test_int8_embeddings_match_fp32(onnx_models):
+    """Test that INT8 quantization keeps embeddings close to the FP32 model's."""
+    fp32_model, int8_model = onnx_models
+
+    fp32 = fp32_model.embed(_TEXTS)
+    int8 = int8_model.embed(_TEXTS)
+
+    assert int8.shape == fp32.shape
+    # Both are L2-normalized, so the row-wise dot product is the cosine
+    cosines = np.sum(fp32 * int8, axis=1)
+    assert cosines.min() >= INT8_MIN_COSINE
@@ -2,95 +2,187 @@
 Unit tests for the vector store service.
 """
 import pytest
-import sys
-import os
 import numpy as np
 import uuid
-import tempfile
-import shutil
-
-# Add the parent directory to sys.path
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from app.services.vector_store import VectorStore
-from app.services.embedding import embedding_service
 
-def test_vector_store_dimensions():
+@pytest.mark.integration
+def test_vector_store_dimensions(fresh_vs, cached_embed, conversation_id):
     """Test that the vector store is using the correct dimensions."""
-    # Create a temporary directory for index files
-    temp_dir = tempfile.mkdtemp()
-    try:
-        # Create a vector store with the default dimension (should be 384 for bge-small-en-v1.5)
-        vs = VectorStore(index_dir=temp_dir)
-        
-        # Check that the dimension is 384
-        assert vs.dimension == 384
-        
-        # Generate a test embedding
-        test_text = "This is a test sentence for embedding"
-        embedding = embedding_service.generate_embedding(test_text)
-        
-        # Check that the embedding dimension matches the vector store dimension
-        assert len(embedding) == vs.dimension
-        
-        # Test adding the embedding to the store
-        conversation_id = str(uuid.uuid4())
-        chunk_id = 1
-        
-        # Add embedding to store
-        idx = vs.add_embedding(embedding, conversation_id, chunk_id)
-        
-        # Verify it was added successfully
-        assert idx is not None
-        
-        # Test search functionality
-        results = vs.search(embedding, conversation_id, top_k=1)
-        
-        # Verify we get a result
-        assert len(results) == 1
-        assert results[0][0] == chunk_id  # First result should be the chunk we added
-        assert results[0][1] > 0.9  # Similarity to itself should be very high
-    
-    finally:
-        # Clean up the temporary directory
-        shutil.rmtree(temp_dir)
+    vs = fresh_vs
+    
+    # Check that the dimension is 384 (the default, for bge-small-en-v1.5)
+    assert vs.dimension == 384
+    
+    # Generate a test embedding, as the float32 array both add and search take without copying
+    test_text = "This is a test sentence for embedding"
+    embedding = cached_embed(test_text)
+    
+    # Check that the embedding dimension matches the vector store dimension
+    assert len(embedding) == vs.dimension
+    
+    # Test adding the embedding to the store
+    chunk_id = 1
+    
+    # Add embedding to store
+    idx = vs.add_embedding(embedding, conversation_id, chunk_id)
+    
+    # Verify it was added successfully
+    assert idx is not None
+    
+    # Test search functionality
+    results = vs.search(embedding, conversation_id, top_k=1)
+    
+    # Verify we get a result
+    assert len(results) == 1
+    assert results[0][0] == chunk_id  # First result should be the chunk we added
+    assert results[0][1] > 0.9  # Similarity to itself should be very high
 
-def test_vector_store_handles_dimension_mismatch():
+def test_vector_store_handles_dimension_mismatch(fresh_vs, conversation_id):
     """Test that the vector store correctly handles dimension mismatches."""
-    # Create a temporary directory for index files
-    temp_dir = tempfile.mkdtemp()
-    try:
-        # Create a vector store with the default dimension
-        vs = VectorStore(index_dir=temp_dir)
-        
-        # Create a test embedding with wrong dimension
-        wrong_embedding = [0.1] * (vs.dimension - 50)  # 50 fewer dimensions
-        
-        # Create a test embedding with extra dimensions
-        extra_embedding = [0.1] * (vs.dimension + 50)  # 50 more dimensions
-        
-        conversation_id = str(uuid.uuid4())
-        
-        # Add the wrong dimension embedding
-        result1 = vs.add_embedding(wrong_embedding, conversation_id, chunk_id=1)
-        
-        # Add the extra dimension embedding
-        result2 = vs.add_embedding(extra_embedding, conversation_id, chunk_id=2)
-        
-        # Both should succeed, with internal correction
-        assert result1 is not None
-        assert result2 is not None
-        
-        # Verify search still works
-        query = [0.1] * vs.dimension
-        results = vs.search(query, conversation_id, top_k=2)
-        
-        # Should find both results
-        assert len(results) == 2
-    
-    finally:
-        # Clean up the temporary directory
-        shutil.rmtree(temp_dir)
+    vs = fresh_vs
+    
+    # Random rather than constant vectors, so no two embeddings score alike by accident
+    rng = np.random.default_rng(42)
+    
+    # Create a test embedding with wrong dimension
+    wrong_embedding = rng.standard_normal(vs.dimension - 50, dtype=np.float32)  # 50 fewer dimensions
+    
+    # Create a test embedding with extra dimensions
+    extra_embedding = rng.standard_normal(vs.dimension + 50, dtype=np.float32)  # 50 more dimensions
+    
+    # Add the wrong dimension embedding
+    result1 = vs.add_embedding(wrong_embedding, conversation_id, chunk_id=1)
+    
+    # Add the extra dimension embedding
+    result2 = vs.add_embedding(extra_embedding, conversation_id, chunk_id=2)
+    
+    # Both should succeed, with internal correction
+    assert result1 is not None
+    assert result2 is not None
+    
+    # The same vectors fitted up front go in as one matrix
+    fitted = np.zeros((2, vs.dimension), dtype=np.float32)
+    fitted[0, :wrong_embedding.size] = wrong_embedding
+    fitted[1] = extra_embedding[:vs.dimension]
+    assert vs.add_embeddings(fitted, conversation_id, [3, 4]) == ["3", "4"]
+    
+    # Verify search still works
+    query = rng.standard_normal(vs.dimension, dtype=np.float32)
+    results = vs.search(query, conversation_id, top_k=4)
+    
+    # Should find all four results, each fitted vector scoring like its twin
+    assert len(results) == 4
+    scores = dict(results)
+    assert scores[1] == pytest.approx(scores[3])
+    assert scores[2] == pytest.approx(scores[4])
+
+def test_vector_store_add_embeddings_batch(fresh_vs, conversation_id):
+    """Test that a batch of embeddings is added with one id per input."""
+    vs = fresh_vs
+    
+    # Include an empty embedding and a dimension mismatch in the batch
+    embeddings = [
+        [1.0] + [0.0] * (vs.dimension - 1),
+        [],
+        [0.0, 1.0] + [0.0] * (vs.dimension - 52),
+    ]
+    ids = vs.add_embeddings(embeddings, conversation_id, [10, 11, 12])
+    
+    # Empty embeddings are skipped, the rest are stored under their chunk ids
+    assert ids == ["10", None, "12"]
+    
+    # Verify the vectors map back to their chunks
+    results = vs.search(embeddings[2] + [0.0] * 50, conversation_id, top_k=1)
+    assert results[0][0] == 12
+    
+    # Discarded chunks are no longer returned
+    vs.discard_chunks(conversation_id, [12])
+    results = vs.search(embeddings[2] + [0.0] * 50, conversation_id, top_k=2)
+    assert [chunk_id for chunk_id, _ in results] == [10]
+
+def test_vector_store_switches_large_index_to_hnsw(tmp_path):
+    """Test that a large conversation's index is rebuilt as HNSW and still found."""
+    import faiss
+    from app.services.vector_store import HNSW_MIN_VECTORS
+    
+    vs = VectorStore(index_dir=str(tmp_path))
+    conversation_id = str(uuid.uuid4())
+    
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((HNSW_MIN_VECTORS, vs.dimension)).astype(np.float32)
+    chunk_ids = list(range(HNSW_MIN_VECTORS))
+    vs.add_embeddings(vectors[:-1], conversation_id, chunk_ids[:-1])
+    assert isinstance(faiss.downcast_index(vs.indices[conversation_id].index), faiss.IndexFlat)
+    
+    # The vector reaching the threshold triggers the rebuild
+    vs.add_embedding(vectors[-1], conversation_id, chunk_ids[-1])
+    assert isinstance(faiss.downcast_index(vs.indices[conversation_id].index), faiss.IndexHNSWFlat)
+    
+    # Every chunk is still found by its own vector
+    for i in (0, 500, HNSW_MIN_VECTORS - 1):
+        assert vs.search(vectors[i], conversation_id, top_k=1)[0][0] == chunk_ids[i]
+    
+    # The HNSW index is what gets reloaded from disk
+    vs.flush(conversation_id)
+    reloaded = VectorStore(index_dir=str(tmp_path))
+    assert reloaded.search(vectors[500], conversation_id, top_k=1)[0][0] == 500
+
+def test_quantized_index_matches_exact_search(tmp_path, monkeypatch):
+    """Test that 8-bit quantized vectors stay close to float32 and keep top-1 retrieval."""
+    import faiss
+    import app.services.vector_store as vector_store_module
+    
+    monkeypatch.setattr(vector_store_module, "VECTOR_QUANTIZE", True)
+    monkeypatch.setattr(vector_store_module, "HNSW_MIN_VECTORS", 256)
+    vs = VectorStore(index_dir=str(tmp_path))
+    conversation_id = str(uuid.uuid4())
+    
+    # Unit vectors, like the normalized embeddings the model returns
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((256, vs.dimension)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    vs.add_embeddings(vectors, conversation_id, list(range(256)))
+    index = vs.indices[conversation_id]
+    assert isinstance(faiss.downcast_index(index.index), faiss.IndexHNSWSQ)
+    
+    # Decoded vectors are within rounding of the originals
+    decoded = index.index.reconstruct_n(0, index.ntotal)
+    cosines = np.sum(decoded * vectors, axis=1) / np.linalg.norm(decoded, axis=1)
+    assert cosines.min() > 0.99
+    
+    # Slightly perturbed queries still retrieve their own chunk first
+    queries = vectors[::16] + rng.normal(0, 0.01, (16, vs.dimension)).astype(np.float32)
+    for chunk_id, query in zip(range(0, 256, 16), queries):
+        assert vs.search(query, conversation_id, top_k=1)[0][0] == chunk_id
+
+@pytest.mark.integration
+@pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+def test_vector_store_recall_at_scale(tmp_path, monkeypatch, index_type):
+    """Test that both index types find stored vectors in a 10k-vector conversation."""
+    import faiss
+    import app.services.vector_store as vector_store_module
+    
+    corpus_size = 10_000
+    if index_type == "flat":
+        # Keep the conversation below the HNSW threshold
+        monkeypatch.setattr(vector_store_module, "HNSW_MIN_VECTORS", corpus_size + 1)
+    vs = VectorStore(index_dir=str(tmp_path))
+    conversation_id = str(uuid.uuid4())
+    
+    vectors = np.random.default_rng(0).standard_normal((corpus_size, vs.dimension)).astype(np.float32)
+    vs.add_embeddings(vectors, conversation_id, list(range(corpus_size)))
+    
+    # Make sure the intended index is the one being searched
+    expected = faiss.IndexFlat if index_type == "flat" else faiss.IndexHNSWFlat
+    assert isinstance(faiss.downcast_index(vs.indices[conversation_id].index), expected)
+    
+    hits = sum(
+        vs.search(vectors[i], conversation_id, top_k=1)[0][0] == i
+        for i in range(100)
+    )
+    assert hits / 100 >= 0.9
 
 def test_vector_store_singleton():
     """Test that the global vector store instance has the correct dimension."""